@@ -2,27 +2,95 @@ import flask
 from flask import request
 import os
 import time
+import threading
 from collections import Counter
-import telebot.apihelper
-from polybot.bot import Bot, QuoteBot, ImageProcessingBot
-from polybot.s3 import download_predicted_image_from_s3  # ✅ Make sure you import this!
+from loguru import logger
+from polybot.bot import Bot, QuoteBot, ImageProcessingBot, sends_predicted_image
+from polybot.workers import FilterPool
+from polybot.cache import ResultCache
+from polybot.metrics import setup_metrics
+from polybot.scheduler import FairScheduler
+from polybot.sqs_producer import get_producer
+from polybot.dedup import DedupIndex
 
 app = flask.Flask(__name__)
 
 TELEGRAM_BOT_TOKEN = os.environ['TELEGRAM_BOT_TOKEN']
 BOT_APP_URL = os.environ['BOT_APP_URL']
+# the self-signed certificate of the webhook, only sent to Telegram when the file exists
+TELEGRAM_CERT_PATH = os.getenv('TELEGRAM_CERT_PATH', '/home/ubuntu/TelegramBot/polybot.crt')
+
+# === Metrics go to the OTel collector, set up before the filter workers fork ===
+setup_metrics('polybot')
+
+# === With FILTER_QUEUE_URL filter jobs go to the queue and run on `python -m polybot.filter_worker` nodes ===
+FILTER_QUEUE_URL = os.getenv('FILTER_QUEUE_URL')
+job_queue = get_producer(FILTER_QUEUE_URL, os.getenv('AWS_REGION'), 'filter_jobs') if FILTER_QUEUE_URL else None
+
+# === Filter jobs run in worker processes, not in the webhook thread ===
+if job_queue is None:
+    filter_pool = FilterPool(int(os.getenv('FILTER_WORKERS', 0)) or None, int(os.getenv('FILTER_MAX_PENDING', 0)) or None)
+else:
+    # only concat1/concat2 run here, the first photo is kept on this node's disk
+    filter_pool = FilterPool(int(os.getenv('CONCAT_WORKERS', 1)))
+
+# === Filtered results of the same photo and caption are resent from the cache ===
+result_cache = ResultCache(int(os.getenv('RESULT_CACHE_MB', 64)) * 1024 * 1024,
+                           os.getenv('RESULT_CACHE_DIR'),
+                           int(os.getenv('RESULT_CACHE_DISK_MB', 512)) * 1024 * 1024)
+
+# === Photos are rate limited per chat and queued fairly across chats, the pool gets one job per free slot ===
+# with the queue a slot is only held while the job is sent, SCHEDULER_WORKERS of them run at once
+scheduler = FairScheduler.from_env(int(os.getenv('SCHEDULER_WORKERS', 0))
+                                   or (filter_pool.max_pending if job_queue is None else 16))
+
+# === Updates Telegram redelivers (a slow answer, a retry) are acknowledged without running them again ===
+dedup = DedupIndex.from_env()
 
 # === Create bot instance early ===
-bot = Bot(TELEGRAM_BOT_TOKEN, BOT_APP_URL)
+bot = Bot(TELEGRAM_BOT_TOKEN, BOT_APP_URL, filter_pool, result_cache, scheduler, job_queue, register_webhook=False)
+
+# === The webhook is registered in the background, the server starts right away and /ready tells when it is set ===
+ready = threading.Event()
+
+
+def register_webhook():
+    delay = 1
+    while True:
+        try:
+            bot.register_webhook(TELEGRAM_CERT_PATH if os.path.exists(TELEGRAM_CERT_PATH) else None)
+            ready.set()
+            return
+        except Exception as e:
+            logger.error(f"Failed to set webhook, retrying in {delay} s: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+
+
+threading.Thread(target=register_webhook, name='register-webhook', daemon=True).start()
 
 @app.route('/', methods=['GET'])
 def index():
     return 'Ok'
 
+@app.route('/ready', methods=['GET'])
+def readiness():
+    if not ready.is_set():
+        return 'Registering webhook', 503
+    return 'Ok'
+
 @app.route(f'/{TELEGRAM_BOT_TOKEN}/', methods=['POST'])
 def webhook():
     req = request.get_json()
-    bot.route(req['message'])
+    if not dedup.first_seen(req):
+        logger.info(f"Duplicate update {req.get('update_id')} acknowledged")
+        return 'Ok'
+    try:
+        bot.route(req['message'])
+    except Exception:
+        # Telegram gets a 500 and retries the update, it must not be taken for a duplicate then
+        dedup.release(req)
+        raise
     return 'Ok'
 
 @app.route("/yolo_callback", methods=['POST'])
@@ -39,26 +107,11 @@ def yolo_callback():
     bot.telegram_bot_client.send_message(chat_id, text)
 
     # ✅ Optional: Only send image if condition is met
-    if int(image_id) % 2 == 0:
-        tmp_predicted = f"/tmp/{chat_id}_{image_id}"
-        download_predicted_image_from_s3(chat_id, image_id, tmp_predicted)
-        with open(tmp_predicted, "rb") as img:
-            bot.telegram_bot_client.send_photo(chat_id, img)
-        os.remove(tmp_predicted)
+    if sends_predicted_image(image_id, 'callback'):
+        from polybot.s3 import read_predicted_image_from_s3
+        bot.telegram_bot_client.send_photo(chat_id, read_predicted_image_from_s3(chat_id, image_id))
 
     return {"status": "ok"}
 
 if __name__ == "__main__":
-    cert_path = "/home/ubuntu/TelegramBot/polybot.crt"
-
-    try:
-        webhook_info = bot.telegram_bot_client.get_webhook_info()
-        if not webhook_info.url or webhook_info.url != f"{BOT_APP_URL}/{TELEGRAM_BOT_TOKEN}/":
-            bot.telegram_bot_client.set_webhook(
-                url=f"{BOT_APP_URL}/{TELEGRAM_BOT_TOKEN}/",
-                certificate=open(cert_path, "rb")
-            )
-    except telebot.apihelper.ApiTelegramException as e:
-        print(f"Failed to set webhook: {e}")
-
     app.run(host='0.0.0.0', port=8443)
@@ -0,0 +1,123 @@
+import os
+import asyncio
+from collections import Counter
+from aiohttp import web
+from loguru import logger
+from polybot.async_bot import AsyncBot
+from polybot.bot import sends_predicted_image
+from polybot.workers import FilterPool
+from polybot.cache import ResultCache
+from polybot.metrics import setup_metrics
+from polybot.scheduler import FairScheduler
+from polybot.dedup import DedupIndex
+
+TELEGRAM_BOT_TOKEN = os.environ['TELEGRAM_BOT_TOKEN']
+BOT_APP_URL = os.environ['BOT_APP_URL']
+# the self-signed certificate of the webhook, only sent to Telegram when the file exists
+TELEGRAM_CERT_PATH = os.getenv('TELEGRAM_CERT_PATH', '/home/ubuntu/TelegramBot/polybot.crt')
+
+routes = web.RouteTableDef()
+
+
+def track(app, coro):
+    """
+    Runs `coro` in the background and keeps a reference to it until it is done.
+    """
+    task = asyncio.create_task(coro)
+    app['tasks'].add(task)
+    task.add_done_callback(app['tasks'].discard)
+
+
+@routes.get('/')
+async def index(request):
+    return web.Response(text='Ok')
+
+
+@routes.get('/ready')
+async def readiness(request):
+    if not request.app['ready'].is_set():
+        return web.Response(text='Registering webhook', status=503)
+    return web.Response(text='Ok')
+
+
+@routes.post(f'/{TELEGRAM_BOT_TOKEN}/')
+async def webhook(request):
+    req = await request.json()
+    # with a DynamoDB table this is a blocking call, keep it off the event loop
+    if not await asyncio.to_thread(request.app['dedup'].first_seen, req):
+        logger.info(f"Duplicate update {req.get('update_id')} acknowledged")
+        return web.Response(text='Ok')
+    if 'message' in req:
+        track(request.app, request.app['bot'].route(req['message']))
+    return web.Response(text='Ok')
+
+
+async def send_yolo_result(bot, chat_id, labels, image_id):
+    objects = Counter(labels)
+    text = "✅ YOLO done! Objects found:\n"
+    text += "\n".join([f"{obj} × {count}" for obj, count in objects.items()])
+    await bot.send_text(chat_id, text)
+
+    if sends_predicted_image(image_id, 'callback'):
+        from polybot.s3 import read_predicted_image_from_s3
+        predicted = await asyncio.to_thread(read_predicted_image_from_s3, chat_id, image_id)
+        await bot.telegram_bot_client.send_photo(chat_id, predicted)
+
+
+@routes.post('/yolo_callback')
+async def yolo_callback(request):
+    data = await request.json()
+    track(request.app, send_yolo_result(request.app['bot'], data["chat_id"], data["labels"], data["image_id"]))
+    return web.json_response({"status": "ok"})
+
+
+async def register_webhook(app):
+    delay = 1
+    while True:
+        try:
+            certificate_path = TELEGRAM_CERT_PATH if os.path.exists(TELEGRAM_CERT_PATH) else None
+            await app['bot'].set_webhook(BOT_APP_URL, TELEGRAM_BOT_TOKEN, certificate_path)
+            app['ready'].set()
+            return
+        except Exception as e:
+            logger.error(f"Failed to set webhook, retrying in {delay} s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+
+async def on_startup(app):
+    # the server starts accepting requests right away, /ready tells when the webhook is set
+    app['registration'] = asyncio.create_task(register_webhook(app))
+
+
+async def on_cleanup(app):
+    app['registration'].cancel()
+    if app['tasks']:
+        await asyncio.gather(*app['tasks'], return_exceptions=True)
+    await app['bot'].close()
+    if app['bot'].filter_pool is not None:
+        app['bot'].filter_pool.shutdown()
+
+
+def create_app(filter_pool=None, result_cache=None, scheduler=None):
+    app = web.Application()
+    app['bot'] = AsyncBot(TELEGRAM_BOT_TOKEN, filter_pool, int(os.getenv('TELEGRAM_MAX_CONNECTIONS', 100)), result_cache,
+                          scheduler)
+    app['tasks'] = set()
+    app['ready'] = asyncio.Event()
+    app['dedup'] = DedupIndex.from_env()
+    app.add_routes(routes)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    setup_metrics('polybot')
+    filter_pool = FilterPool(int(os.getenv('FILTER_WORKERS', 0)) or None, int(os.getenv('FILTER_MAX_PENDING', 0)) or None)
+    result_cache = ResultCache(int(os.getenv('RESULT_CACHE_MB', 64)) * 1024 * 1024,
+                               os.getenv('RESULT_CACHE_DIR'),
+                               int(os.getenv('RESULT_CACHE_DISK_MB', 512)) * 1024 * 1024)
+    scheduler = FairScheduler.from_env(filter_pool.max_pending)
+    logger.info('Starting the asyncio webhook server')
+    web.run_app(create_app(filter_pool, result_cache, scheduler), host='0.0.0.0', port=8443)
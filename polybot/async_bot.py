@@ -0,0 +1,193 @@
+import asyncio
+from pathlib import Path
+from loguru import logger
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+from polybot.bot import (GREETING, FILTER_LIST, AI_LIST, BUSY_TEXT, TOO_HEAVY_TEXT, FirstImageMissing, rejection_text,
+                         admit_photo, plan_filter_job, prediction_id, original_image_key, prepare_concat_steps,
+                         sent_file_id, store_first_image)
+from polybot.img_proc import send_prediction_request
+from polybot.workers import run_pipeline
+from polybot.metrics import stage, in_flight
+from polybot.scheduler import Rejected
+from polybot.cost import AdmissionPolicy
+from polybot.sizing import PhotoSizePolicy
+
+
+class AsyncBot:
+    """
+    The asyncio counterpart of `Bot`: same routing and replies, but every Telegram call is awaited over
+    one pooled aiohttp session, so a single process can wait on many downloads and uploads at once.
+    Blocking work (filters, S3, SQS) runs in the filter pool or in threads.
+    """
+
+    def __init__(self, token, filter_pool=None, max_connections=100, result_cache=None, scheduler=None, admission=None,
+                 sizing=None):
+        asyncio_helper.REQUEST_LIMIT = max_connections
+        self.telegram_bot_client = AsyncTeleBot(token)
+        self.filter_pool = filter_pool
+        self.result_cache = result_cache
+        self.scheduler = scheduler
+        self.admission = admission or AdmissionPolicy.from_env()
+        self.sizing = sizing or PhotoSizePolicy.from_env()
+
+    async def set_webhook(self, telegram_chat_url, token, certificate_path=None):
+        """
+        Sets the webhook only when Telegram has a different one, like `ensure_webhook`.
+        """
+        url = f'{telegram_chat_url}/{token}/'
+        info = await self.telegram_bot_client.get_webhook_info()
+        if info.url == url and (certificate_path is None or info.has_custom_certificate):
+            logger.info(f'Webhook already set to {url}')
+            return False
+        if certificate_path is None:
+            await self.telegram_bot_client.set_webhook(url=url, timeout=60)
+        else:
+            certificate = await asyncio.to_thread(Path(certificate_path).read_bytes)
+            await self.telegram_bot_client.set_webhook(url=url, certificate=certificate, timeout=60)
+        logger.info(f'Webhook set to {url}')
+        return True
+
+    async def close(self):
+        await self.telegram_bot_client.close_session()
+
+    async def route(self, msg):
+        with stage('route'):
+            await self._route(msg)
+
+    async def _route(self, msg):
+        chat_id = msg['chat']['id']
+        if 'photo' not in msg:
+            text = msg.get('text', '').strip().lower()
+            if text == '/start':
+                await self.send_greeting(chat_id)
+            elif text == 'captions':
+                await self.send_text(chat_id, FILTER_LIST, parse_mode='Markdown')
+            elif text == 'ai':
+                await self.send_text(chat_id, AI_LIST, parse_mode='Markdown')
+            else:
+                await self.send_text(chat_id, "Please send me an image.")
+            return
+
+        if self.scheduler is None:
+            await self.handle_photo(msg)
+            return
+        admitted = admit_photo(self.admission, self.sizing, msg)
+        if admitted is None:
+            await self.send_text(chat_id, TOO_HEAVY_TEXT)
+            return
+        cost, low_priority = admitted
+        try:
+            await self.scheduler.run_async(chat_id, cost, lambda: self.handle_photo(msg), low_priority)
+        except Rejected as e:
+            logger.info(f"Rejected photo of chat {chat_id}: {e!r}")
+            await self.send_text(chat_id, rejection_text(e))
+
+    async def handle_photo(self, msg):
+        caption = msg.get('caption', '').strip().lower()
+        if caption.startswith('predict'):
+            await self.handle_prediction(msg, caption)
+        else:
+            await self.handle_image(msg)
+
+    async def send_text(self, chat_id, text, **kwargs):
+        await self.telegram_bot_client.send_message(chat_id, text, **kwargs)
+
+    async def send_greeting(self, chat_id):
+        await self.send_text(chat_id, GREETING, parse_mode='Markdown')
+        await self.send_text(chat_id, FILTER_LIST, parse_mode='Markdown')
+        await self.send_text(chat_id, AI_LIST, parse_mode='Markdown')
+
+    async def download_photo(self, photo):
+        with stage('download'):
+            file_info = await self.telegram_bot_client.get_file(photo['file_id'])
+            data = await self.telegram_bot_client.download_file(file_info.file_path)
+        return file_info.file_path, data
+
+    async def run_filters(self, data, steps, name, max_dim=None):
+        if self.filter_pool is None:
+            return await asyncio.to_thread(run_pipeline, data, steps, name, max_dim)
+        future = self.filter_pool.submit(run_pipeline, data, steps, name, max_dim)
+        if future is None:
+            return None
+        with in_flight('filter'):
+            return await asyncio.wrap_future(future)
+
+    async def send_cached(self, chat_id, cached):
+        if cached.file_id:
+            try:
+                await self.telegram_bot_client.send_photo(chat_id, cached.file_id)
+                return
+            except Exception as e:
+                logger.warning(f"Could not resend cached file_id, uploading instead: {e}")
+        await self.telegram_bot_client.send_photo(chat_id, cached.data)
+
+    async def handle_image(self, msg):
+        chat_id = msg['chat']['id']
+        # a result cache hit may be read from disk
+        reply, job = await asyncio.to_thread(plan_filter_job, msg, self.sizing, self.admission, self.result_cache)
+        if reply:
+            await self.send_text(chat_id, reply)
+            return
+        if job.cached:
+            await self.send_cached(chat_id, job.cached)
+            return
+        steps, cache_key = job.steps, job.cache_key
+
+        try:
+            file_path, data = await self.download_photo(job.photo)
+
+            try:
+                steps, store_first, first_img_path = await asyncio.to_thread(prepare_concat_steps, chat_id, steps)
+            except FirstImageMissing:
+                await self.send_text(chat_id, "First image not found.")
+                return
+
+            try:
+                processed = await self.run_filters(data, steps, Path(file_path).name, job.max_dim)
+            except RuntimeError as e:
+                await self.send_text(chat_id, f"Error: {str(e)}")
+                return
+            if processed is None:
+                await self.send_text(chat_id, BUSY_TEXT)
+                return
+
+            if store_first:
+                await asyncio.to_thread(store_first_image, chat_id, processed)
+                await self.send_text(chat_id, "Send the second image with the direction.")
+            else:
+                with stage('send_photo'):
+                    message = await self.telegram_bot_client.send_photo(chat_id, processed)
+                if first_img_path:
+                    first_img_path.unlink(missing_ok=True)
+                if cache_key:
+                    await asyncio.to_thread(self.result_cache.put, cache_key, processed, sent_file_id(message))
+
+        except Exception as e:
+            logger.error(f"AsyncBot image error: {e}")
+            await self.send_text(chat_id, "Error processing image.")
+
+    async def handle_prediction(self, msg, caption='predict'):
+        chat_id = msg['chat']['id']
+        msg_id = prediction_id(msg, caption)
+
+        try:
+            file_path, data = await self.download_photo(self.sizing.select_for_prediction(msg['photo']))
+            s3_key = original_image_key(chat_id, msg_id, file_path)
+            from polybot.s3 import upload_image_bytes_to_s3
+            upload = asyncio.create_task(asyncio.to_thread(upload_image_bytes_to_s3, data, s3_key))
+
+            await self.send_text(chat_id, "✅ Image received! YOLO is processing it...")
+
+            await upload
+            try:
+                # the first call creates the SQS client, after that it is a queue put. The batching producer
+                # resolves the future, no thread waits for it
+                with stage('sqs_send'):
+                    await asyncio.wrap_future(await asyncio.to_thread(send_prediction_request, chat_id, msg_id))
+            except Exception as e:
+                await self.send_text(chat_id, f"❌ Failed to queue image: {e}")
+
+        except Exception as e:
+            logger.error(f"AsyncBot prediction error: {e}")
+            await self.send_text(chat_id, "❌ Prediction failed, try again later.")
@@ -0,0 +1,43 @@
+import os
+import threading
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def client_config():
+    from botocore.config import Config
+    return Config(
+        max_pool_connections=int(os.getenv('AWS_MAX_POOL_CONNECTIONS', 50)),
+        retries={'max_attempts': int(os.getenv('AWS_MAX_ATTEMPTS', 5)), 'mode': 'standard'},
+        connect_timeout=int(os.getenv('AWS_CONNECT_TIMEOUT', 5)),
+        read_timeout=int(os.getenv('AWS_READ_TIMEOUT', 30)),
+    )
+
+
+def get_client(service, region_name=None):
+    """
+    Returns the process wide boto3 client for `service` in `region_name`, creating it on first use.
+    Clients are thread safe, so all threads share one credential lookup and one HTTP connection pool.
+    `<SERVICE>_ENDPOINT_URL` (e.g. SQS_ENDPOINT_URL) points a service at a local stand-in.
+    """
+    key = (service, region_name)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                # boto3 takes a while to import, processes that never call AWS don't pay for it
+                import boto3
+                client = boto3.session.Session().client(
+                    service,
+                    region_name=region_name,
+                    endpoint_url=os.getenv(f'{service.upper()}_ENDPOINT_URL'),
+                    config=client_config(),
+                )
+                _clients[key] = client
+    return client
+
+
+# connection pools must not be shared with forked worker processes
+os.register_at_fork(after_in_child=_clients.clear)
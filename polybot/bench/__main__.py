@@ -0,0 +1,55 @@
+"""
+Times every Img filter, the codecs and the bot request path, and compares the results with the stored baseline.
+
+    python -m polybot.bench                     # everything, compared with polybot/bench/baseline.json
+    python -m polybot.bench --sizes 256 1024    # a quick run on small images
+    python -m polybot.bench --only blur         # only the cases whose name contains "blur"
+    python -m polybot.bench --only startup      # cold start of the webhook process
+    python -m polybot.bench --save              # record the results as the new baseline
+
+Exits with status 1 when a case is slower or uses more memory than the baseline by more than --tolerance.
+Timings depend on the machine, record the baseline on the machine the comparison runs on.
+"""
+import sys
+import argparse
+from itertools import chain
+from polybot.bench.cases import SIZES, LEVELS, filter_cases, codec_cases, bot_cases, startup_cases
+from polybot.bench.runner import BASELINE_PATH, run_cases, load_baseline, save_baseline, compare
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m polybot.bench')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--levels', type=int, nargs='+', default=LEVELS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', help='run only the cases whose name contains this text')
+    parser.add_argument('--no-bot', action='store_true', help='skip the handle_image cases')
+    parser.add_argument('--no-startup', action='store_true', help='skip the cold start cases')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--save', action='store_true', help='store the results as the baseline')
+    args = parser.parse_args(argv)
+
+    cases = chain(filter_cases(args.sizes, args.levels), codec_cases(args.sizes))
+    if not args.no_bot:
+        cases = chain(cases, bot_cases(args.sizes))
+    if not args.no_startup:
+        cases = chain(cases, startup_cases())
+    if args.only:
+        cases = (case for case in cases if args.only in case.name)
+
+    results = run_cases(cases, args.repeat)
+
+    if args.save:
+        save_baseline(results, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    regressions = compare(results, load_baseline(args.baseline), args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
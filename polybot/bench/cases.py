@@ -0,0 +1,137 @@
+import io
+import os
+import sys
+import subprocess
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+from polybot.img_proc import Img
+from polybot.codec import encode_gray, load_gray
+from polybot.bench.runner import Case
+
+SIZES = (256, 1024, 2048, 4096)
+LEVELS = (2, 16, 64)
+CAPTIONS = ('blur 16', 'rotate, contour', 'pixel 10, invert')
+
+SIMPLE_FILTERS = (
+    ('contour', ()), ('rotate', ()), ('salt_n_pepper', ()), ('segment', ()), ('invert', ()), ('binary', ()),
+    ('flip', ('vertical',)), ('flip', ('horizontal',)),
+)
+
+
+def synthetic_image(size):
+    """
+    A reproducible size x size gray image: smooth gradients plus noise, so it compresses like a photo.
+    """
+    rng = np.random.default_rng(size)
+    y, x = np.mgrid[0:size, 0:size] / size
+    smooth = 127 + 64 * np.sin(6 * x) * np.cos(4 * y) + 48 * x
+    return np.clip(smooth + rng.normal(0, 12, (size, size)), 0, 255).astype(np.uint8)
+
+
+def encode_jpeg(pixels, quality=85):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def _filter_case(name, pixels, method, args):
+    return Case(name, lambda: Img.from_pixels(pixels), lambda img: getattr(img, method)(*args))
+
+
+def filter_cases(sizes=SIZES, levels=LEVELS):
+    """
+    Every Img filter on every size, blur and pixelate at every level smaller than the image.
+    """
+    for size in sizes:
+        pixels = synthetic_image(size)
+        for method, args in SIMPLE_FILTERS:
+            yield _filter_case(f"{method}{''.join(' ' + a for a in args)} {size}", pixels, method, args)
+        for level in levels:
+            if level < size:
+                yield _filter_case(f"blur {level} {size}", pixels, 'blur', (level,))
+                yield _filter_case(f"pixelate {level} {size}", pixels, 'pixelate', (level,))
+        yield Case(f"concat {size}", lambda p=pixels: Img.from_pixels(p), lambda img: img.concat(img))
+        yield Case(f"to_bytes {size}", lambda p=pixels: Img.from_pixels(p, 'image.jpg'), lambda img: img.to_bytes())
+
+
+def codec_cases(sizes=SIZES, formats=('jpeg', 'png')):
+    """
+    Encoding and decoding every size in every format, the encode cases also record the encoded size.
+    """
+    for size in sizes:
+        pixels = synthetic_image(size)
+        for fmt in formats:
+            encoded = encode_gray(pixels, fmt)
+            yield Case(f"encode {fmt} {size}", lambda p=pixels: p, lambda p, fmt=fmt: encode_gray(p, fmt))
+            yield Case(f"decode {fmt} {size}", lambda e=encoded: io.BytesIO(e), load_gray)
+
+
+def mock_telegram(image_bytes):
+    client = mock.MagicMock()
+    client.get_file.return_value = mock.Mock(file_path='photos/file_1.jpg')
+    client.download_file.return_value = image_bytes
+    return client
+
+
+def photo_message(caption, size):
+    return {
+        'chat': {'id': 1}, 'message_id': 1, 'caption': caption,
+        'photo': [{'file_id': 'bench', 'file_unique_id': 'bench', 'width': size, 'height': size}],
+    }
+
+
+def bot_cases(sizes=SIZES, captions=CAPTIONS):
+    """
+    The whole request path of both image bots, with Telegram, S3 and SQS mocked out:
+    download, decode, filter and encode for ImageProcessingBot, download and hand-off for ImagePredictionBot.
+    """
+    # polybot.s3 reads its settings at import time
+    os.environ.setdefault('AWS_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_S3_BUCKET', 'polybot-bench')
+    from polybot import bot
+
+    for size in sizes:
+        image_bytes = encode_jpeg(synthetic_image(size))
+        for caption in captions:
+            def run(client, caption=caption, size=size):
+                bot.ImageProcessingBot(client).handle_image(photo_message(caption, size))
+                assert client.send_photo.called, client.send_message.call_args
+            yield Case(f"handle_image '{caption}' {size}", lambda b=image_bytes: mock_telegram(b), run)
+
+        def run_prediction(client, size=size):
+            with mock.patch.object(bot, 'upload_image_bytes_to_s3_in_background', lambda data, key, on_done: on_done(None)), \
+                    mock.patch.object(bot, 'request_prediction', return_value={'status': 'queued'}):
+                bot.ImagePredictionBot(client).handle_image(photo_message('predict', size))
+        yield Case(f"handle_image 'predict' {size}", lambda b=image_bytes: mock_telegram(b), run_prediction)
+
+
+# starts the webhook app with Telegram mocked out and polls /ready until the webhook is registered
+APP_STARTUP = """
+import time
+from unittest import mock
+with mock.patch('telebot.TeleBot') as client:
+    client.return_value.get_webhook_info.return_value.url = ''
+    import polybot.app
+    web = polybot.app.app.test_client()
+    while web.get('/ready').status_code != 200:
+        time.sleep(0.001)
+    polybot.app.filter_pool.shutdown()
+"""
+
+
+def _startup_case(name, code):
+    env = {**os.environ, 'TELEGRAM_BOT_TOKEN': 'bench', 'BOT_APP_URL': 'https://bench.invalid',
+           'AWS_REGION': 'us-east-1', 'AWS_S3_BUCKET': 'polybot-bench', 'OTEL_METRICS_EXPORTER': 'none',
+           'FILTER_WORKERS': '1'}
+    return Case(name, lambda: None, lambda _: subprocess.run([sys.executable, '-c', code], env=env, check=True))
+
+
+def startup_cases():
+    """
+    Cold start of a fresh interpreter: importing the bot, and the webhook app until /ready answers.
+    The memory column only covers this process, not the started one.
+    """
+    yield _startup_case('startup import polybot.bot', 'import polybot.bot')
+    yield _startup_case('startup polybot.app until ready', APP_STARTUP)
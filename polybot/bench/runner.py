@@ -0,0 +1,87 @@
+import json
+import time
+import platform
+import tracemalloc
+from collections import namedtuple
+from pathlib import Path
+
+BASELINE_PATH = Path(__file__).with_name('baseline.json')
+
+# a case runs `run(setup())`, setup is not timed, so filters that work in place get a fresh image every round
+Case = namedtuple('Case', ['name', 'setup', 'run'])
+
+
+def measure(case, repeat=5):
+    """
+    Best wall time of `repeat` rounds, and the peak of traced allocations (Python and NumPy) of one more round.
+    Memory is measured in a separate round because tracing slows the allocations down.
+    Cases that return bytes (encoders) also record how many.
+    """
+    times = []
+    for _ in range(repeat):
+        state = case.setup()
+        start = time.perf_counter()
+        output = case.run(state)
+        times.append(time.perf_counter() - start)
+
+    state = case.setup()
+    tracemalloc.start()
+    try:
+        case.run(state)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    result = {'seconds': round(min(times), 6), 'peak_mb': round(peak / 2 ** 20, 3)}
+    if isinstance(output, bytes):
+        result['bytes'] = len(output)
+    return result
+
+
+def run_cases(cases, repeat=5, report=print):
+    results = {}
+    for case in cases:
+        results[case.name] = measure(case, repeat)
+        result = results[case.name]
+        size = f" {result['bytes'] / 1024:>10.1f} KB" if 'bytes' in result else ''
+        report(f"{case.name:<48} {result['seconds'] * 1000:>10.2f} ms {result['peak_mb']:>10.2f} MB{size}")
+    return results
+
+
+def load_baseline(path=BASELINE_PATH):
+    path = Path(path)
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())['results']
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    """
+    Stores `results` merged into the existing baseline, so a partial run (--only, --sizes) updates just its cases.
+    """
+    merged = {**load_baseline(path), **results}
+    payload = {
+        'machine': {'python': platform.python_version(), 'processor': platform.processor() or platform.machine()},
+        'results': dict(sorted(merged.items())),
+    }
+    Path(path).write_text(json.dumps(payload, indent=2) + '\n')
+
+
+def compare(results, baseline, tolerance=0.25, min_seconds=0.002):
+    """
+    Returns one line per case that got slower, uses more memory or (encoders) outputs more bytes than the baseline
+    by more than `tolerance`.
+    Time differences below `min_seconds` are ignored, they are mostly timer noise.
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        slower = result['seconds'] - before['seconds']
+        if slower > min_seconds and result['seconds'] > before['seconds'] * (1 + tolerance):
+            regressions.append(f"{name}: {before['seconds'] * 1000:.2f} ms -> {result['seconds'] * 1000:.2f} ms")
+        if result['peak_mb'] > before['peak_mb'] * (1 + tolerance) + 0.1:
+            regressions.append(f"{name}: {before['peak_mb']:.2f} MB -> {result['peak_mb']:.2f} MB peak")
+        if 'bytes' in before and result.get('bytes', 0) > before['bytes'] * (1 + tolerance):
+            regressions.append(f"{name}: {before['bytes']} -> {result['bytes']} bytes")
+    return regressions
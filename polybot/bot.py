@@ -1,27 +1,237 @@
 import os
+import math
 import time
-import shutil
 from pathlib import Path
-from collections import Counter
+from collections import Counter, namedtuple
 import telebot
 from loguru import logger
-from telebot.types import InputFile
-from polybot.img_proc import Img
-from polybot.s3 import upload_image_to_s3, download_predicted_image_from_s3
+from polybot.img_proc import Img, send_prediction_request
+from polybot.pipeline import Step, InvalidFilterError, parse_caption, plan_key
+from polybot.workers import run_inline, run_pipeline
+from polybot.metrics import stage, timed, record_stage, job_started, job_finished
+from polybot.profiling import profiled, message_tags
+from polybot.scheduler import RateLimited, ChatQueueFull, Rejected, LIGHT_JOB_COST
+from polybot.cost import AdmissionPolicy, REJECT, LOW_PRIORITY, photo_size
+from polybot.sizing import PhotoSizePolicy, long_side, scale_steps
+from polybot.jobs import job_body, queueable
+
+
+GREETING = (
+    "👋 Hi there! Welcome to PolyBot.\n"
+    "Send a *photo* with a *caption*.\n"
+    "- Type *captions* for image filters\n"
+    "- Type *AI* for AI features\n"
+    "- Use commas to apply multiple filters"
+)
+
+FILTER_LIST = (
+    "The Available Filters Are:\n"
+    "1) *blur* - Smoothens the image.\n"
+    "2) *contour* - Detects edges.\n"
+    "3) *rotate* - Rotates the image 90° clockwise.\n"
+    "4) *segment* - Segments light/dark regions.\n"
+    "5) *salt and pepper* - Adds random noise.\n"
+    "6) *concat* - Concatenates the image with itself.\n"
+    "7) *invert* - Inverts pixel intensities.\n"
+    "8) *binary* - Converts to black & white.\n"
+    "9) *flip* - Flips the image.\n"
+    "10) *pixel* - Pixelates the image.\n"
+    "Note1: *concat* and *flip* can be applied in *horizontal* or *vertical* direction.\n"
+    "Note2: *blur* and *pixel* can be given a level value.\n"
+    "Note3: Use *concat1* to upload the first image and *concat2* to upload the second image for concatenation.\n"
+)
+
+AI_LIST = (
+    "AI Features:\n"
+    "*predict* – Detects objects in the image\n"
+    "*predict show* – Detects objects and returns the annotated image"
+)
+
+BUSY_TEXT = "⏳ I'm busy with other images right now, please retry in a few seconds."
+RATE_LIMITED_TEXT = "🐢 Easy there! You can send your next photo in {seconds} seconds."
+CHAT_QUEUE_FULL_TEXT = "🐢 I'm still working on your previous photos, please wait for them before sending more."
+TOO_HEAVY_TEXT = "🏋️ These filters are too heavy for a photo this large. Try fewer filters, lower levels or a smaller photo."
+
+# a prediction is reported by YOLO's call to /yolo_callback and, with S3 event notifications on the bucket,
+# by an event on the consumer's queue. The annotated image is sent by one of them only: 'callback' or 'event'
+PREDICTED_IMAGE_CHANNEL = os.getenv('PREDICTED_IMAGE_CHANNEL', 'callback')
+
+
+class FirstImageMissing(Exception):
+    pass
+
+
+def rejection_text(error: Rejected):
+    if isinstance(error, RateLimited):
+        return RATE_LIMITED_TEXT.format(seconds=math.ceil(error.retry_after))
+    if isinstance(error, ChatQueueFull):
+        return CHAT_QUEUE_FULL_TEXT
+    return BUSY_TEXT
+
+
+def prepare_concat_steps(chat_id, steps):
+    """
+    Resolves the concat1/concat2 steps of a plan.
+    Returns the steps to run, whether the result should be kept as the first image of a concat
+    and the path of the stored first image used by concat2, if any.
+    """
+    steps = list(steps)
+    first_img_path = None
+    for i, step in enumerate(steps):
+        if step.name == 'concat1':
+            return steps[:i], True, None
+
+        if step.name == 'concat2':
+            first_img_path = Path(f'temp/{chat_id}/first_img.jpg')
+            if not first_img_path.exists():
+                raise FirstImageMissing()
+            steps[i] = Step('concat', (step.args[0], Img(str(first_img_path))))
+    return steps, False, first_img_path
+
+
+def result_cache_key(result_cache, photo, steps, max_dim=None):
+    """
+    `photo` is the size the steps run on: their levels are scaled to it, so the key must name that size.
+    """
+    if result_cache is None:
+        return None
+    plan = plan_key(steps)
+    if plan is not None and max_dim:
+        plan = f'{plan}@{max_dim}'
+    return result_cache.make_key(photo.get('file_unique_id'), plan)
+
+
+def scheduling(decision):
+    """
+    The (cost, low priority) a photo job is scheduled with, from its admission decision (None if not a filter job).
+    """
+    if decision is None:
+        return LIGHT_JOB_COST, False
+    return decision.cost.seconds, decision.action == LOW_PRIORITY
+
+
+def admit_photo(admission, sizing, msg):
+    """
+    The (cost, low priority) to schedule a photo message with, None when it is too heavy to run at all.
+    """
+    decision = admission.decide_message(msg, sizing)
+    if decision is not None and decision.action == REJECT:
+        return None
+    return scheduling(decision)
+
+
+# a filter job ready to run: the photo size to download, the steps scaled to it, the size to decode at
+# and the result cache key, with the cached result if there is one
+FilterJob = namedtuple('FilterJob', ['photo', 'steps', 'max_dim', 'cache_key', 'cached'])
+
+
+def plan_filter_job(msg, sizing, admission, result_cache=None):
+    """
+    Parses the caption of a photo message and decides how to run it.
+    Returns (reply, None) when the job doesn't run, e.g. an invalid caption, and (None, FilterJob) otherwise.
+    """
+    try:
+        steps = parse_caption(msg.get('caption', ''))
+    except InvalidFilterError as e:
+        return str(e), None
+    if not steps:
+        return "Please provide at least one filter in the caption.", None
+
+    photo, steps = sizing.select(msg['photo'], steps)
+    decision = admission.decide(steps, *photo_size(photo))
+    if decision.action == REJECT:
+        return TOO_HEAVY_TEXT, None
+    if decision.max_dim and 0 < decision.max_dim < long_side(photo):
+        # blur and pixelate levels are in pixels of the photo, keep them looking the same on the downscaled one
+        steps = scale_steps(steps, decision.max_dim / long_side(photo))
+
+    cache_key = result_cache_key(result_cache, photo, steps, decision.max_dim)
+    cached = result_cache.get(cache_key) if cache_key else None
+    return None, FilterJob(photo, steps, decision.max_dim, cache_key, cached)
+
+
+def prediction_id(msg, caption):
+    """
+    The image id a prediction is uploaded under. The YOLO callback sends the predicted image back only
+    for even ids, so 'predict show' gets an even one and a plain 'predict' an odd one.
+    """
+    message_id = int(msg['message_id'])
+    wanted = 0 if 'show' in caption else 1
+    return message_id if message_id % 2 == wanted else str(message_id + 1)
+
+
+def sends_predicted_image(image_id, channel):
+    """
+    Whether `channel` ('callback' or 'event') sends the annotated image of prediction `image_id`:
+    it has to be the configured one, and the user must have asked for it (an even id, see prediction_id).
+    """
+    return channel == PREDICTED_IMAGE_CHANNEL and int(image_id) % 2 == 0
+
+
+def original_image_key(chat_id, image_id, file_path):
+    return f"{chat_id}/original/image_{image_id}{Path(file_path).suffix or '.jpg'}"
+
+
+def sent_file_id(message):
+    """
+    The Telegram file_id of the largest size of a photo we just sent, so it can be resent without uploading.
+    """
+    photos = getattr(message, 'photo', None)
+    file_id = photos[-1].file_id if photos else None
+    return file_id if isinstance(file_id, str) else None
+
+
+def store_first_image(chat_id, image_bytes):
+    user_dir = Path(f'temp/{chat_id}')
+    user_dir.mkdir(parents=True, exist_ok=True)
+    (user_dir / 'first_img.jpg').write_bytes(image_bytes)
+
+
+def upload_image_bytes_to_s3_in_background(data, s3_key, on_done=None):
+    # polybot.s3 pulls in boto3, it is imported by the first prediction instead of at start up
+    from polybot import s3
+    return s3.upload_image_bytes_to_s3_in_background(data, s3_key, on_done)
+
+
+def ensure_webhook(client, url, certificate_path=None):
+    """
+    Sets the webhook only when Telegram has a different one, so a restart or every new replica of a deploy
+    costs one get_webhook_info call. Returns whether the webhook was changed.
+    """
+    info = client.get_webhook_info()
+    if info.url == url and (certificate_path is None or info.has_custom_certificate):
+        logger.info(f'Webhook already set to {url}')
+        return False
+    if certificate_path is None:
+        client.set_webhook(url=url, timeout=60)
+    else:
+        with open(certificate_path, 'rb') as certificate:
+            client.set_webhook(url=url, certificate=certificate, timeout=60)
+    logger.info(f'Webhook set to {url}')
+    return True
 
 
 class Bot:
-    def __init__(self, token, telegram_chat_url):
+    def __init__(self, token, telegram_chat_url, filter_pool=None, result_cache=None, scheduler=None, job_queue=None,
+                 register_webhook=True):
+        self.scheduler = scheduler
         self.telegram_bot_client = telebot.TeleBot(token)
-        self.telegram_bot_client.remove_webhook()
-        time.sleep(0.5)
-        self.telegram_bot_client.set_webhook(url=f'{telegram_chat_url}/{token}/', timeout=60)
-        logger.info(f'Telegram Bot information\n\n{self.telegram_bot_client.get_me()}')
+        self.webhook_url = f'{telegram_chat_url}/{token}/'
+        if register_webhook:
+            self.register_webhook()
 
-        self.processor = ImageProcessingBot(self.telegram_bot_client)
+        self.processor = ImageProcessingBot(self.telegram_bot_client, filter_pool, result_cache, job_queue=job_queue)
         self.predictor = ImagePredictionBot(self.telegram_bot_client)
 
+    def register_webhook(self, certificate_path=None):
+        return ensure_webhook(self.telegram_bot_client, self.webhook_url, certificate_path)
+
+    @timed('route')
     def route(self, msg):
+        with profiled('route', **message_tags(msg)):
+            self._route(msg)
+
+    def _route(self, msg):
         chat_id = msg['chat']['id']
         if not self.is_current_msg_photo(msg):
             text = msg.get('text', '').strip().lower()
@@ -35,11 +245,29 @@ class Bot:
                 self.send_text(chat_id, "Please send me an image.")
             return
 
-        caption = msg.get('caption', '').strip().lower()
-        if caption.startswith('predict'):
-            self.predictor.handle_image(msg, caption)
-        else:
-            self.processor.handle_image(msg)
+        if self.scheduler is None:
+            self.handle_photo(msg)
+            return
+        admitted = admit_photo(self.processor.admission, self.processor.sizing, msg)
+        if admitted is None:
+            self.send_text(chat_id, TOO_HEAVY_TEXT)
+            return
+        cost, low_priority = admitted
+        try:
+            self.scheduler.submit(chat_id, cost, lambda: self.handle_photo(msg), low_priority)
+        except Rejected as e:
+            logger.info(f"Rejected photo of chat {chat_id}: {e!r}")
+            self.send_text(chat_id, rejection_text(e))
+
+    def handle_photo(self, msg):
+        """
+        Runs the job a photo message asks for. Returns the filter job's Future when it runs in the filter pool.
+        """
+        with profiled('handle_photo', **message_tags(msg)):
+            caption = msg.get('caption', '').strip().lower()
+            if caption.startswith('predict'):
+                return self.predictor.handle_image(msg, caption)
+            return self.processor.handle_image(msg)
 
     def is_current_msg_photo(self, msg):
         return 'photo' in msg
@@ -48,14 +276,7 @@ class Bot:
         self.telegram_bot_client.send_message(chat_id, text)
 
     def send_greeting(self, chat_id):
-        greeting = (
-            "👋 Hi there! Welcome to PolyBot.\n"
-            "Send a *photo* with a *caption*.\n"
-            "- Type *captions* for image filters\n"
-            "- Type *AI* for AI features\n"
-            "- Use commas to apply multiple filters"
-        )
-        self.telegram_bot_client.send_message(chat_id, greeting, parse_mode='Markdown')
+        self.telegram_bot_client.send_message(chat_id, GREETING, parse_mode='Markdown')
         self.processor.send_filter_list(chat_id)
         self.predictor.send_ai_list(chat_id)
 
@@ -69,127 +290,103 @@ class QuoteBot(Bot):
 
 
 class ImageProcessingBot:
-    def __init__(self, bot_client):
+    def __init__(self, bot_client, filter_pool=None, result_cache=None, admission=None, sizing=None, job_queue=None):
         self.bot = bot_client
+        self.filter_pool = filter_pool
+        self.job_queue = job_queue
+        self.result_cache = result_cache
+        self.admission = admission or AdmissionPolicy.from_env()
+        self.sizing = sizing or PhotoSizePolicy.from_env()
 
     def send_filter_list(self, chat_id):
-        filters = (
-            "The Available Filters Are:\n"
-            "1) *blur* - Smoothens the image.\n"
-            "2) *contour* - Detects edges.\n"
-            "3) *rotate* - Rotates the image 90° clockwise.\n"
-            "4) *segment* - Segments light/dark regions.\n"
-            "5) *salt and pepper* - Adds random noise.\n"
-            "6) *concat* - Concatenates the image with itself.\n"
-            "7) *invert* - Inverts pixel intensities.\n"
-            "8) *binary* - Converts to black & white.\n"
-            "9) *flip* - Flips the image.\n"
-            "10) *pixel* - Pixelates the image.\n"
-            "Note1: *concat* and *flip* can be applied in *horizontal* or *vertical* direction.\n"
-            "Note2: *blur* and *pixel* can be given a level value.\n"
-            "Note3: Use *concat1* to upload the first image and *concat2* to upload the second image for concatenation.\n"
-        )
-        self.bot.send_message(chat_id, filters, parse_mode='Markdown')
+        self.bot.send_message(chat_id, FILTER_LIST, parse_mode='Markdown')
 
+    @timed('handle_image', bot='filter')
     def handle_image(self, msg):
         chat_id = msg['chat']['id']
+        reply, job = plan_filter_job(msg, self.sizing, self.admission, self.result_cache)
+        if reply:
+            self.bot.send_message(chat_id, reply)
+            return
+        if job.cached:
+            self.send_cached(chat_id, job.cached)
+            return
+        steps, cache_key = job.steps, job.cache_key
+
+        if self.job_queue is not None and queueable(steps):
+            return self.enqueue(chat_id, msg, job.photo, steps, job.max_dim)
+
         try:
-            file_info = self.bot.get_file(msg['photo'][-1]['file_id'])
-            data = self.bot.download_file(file_info.file_path)
-            folder = file_info.file_path.split('/')[0]
-            os.makedirs(folder, exist_ok=True)
-            with open(file_info.file_path, 'wb') as f:
-                f.write(data)
-            img_path = file_info.file_path
-            img = Img(img_path)
-
-            caption_raw = msg.get('caption', '').strip().lower()
-            captions = [c.strip() for c in caption_raw.split(',') if c.strip()]
-            if not captions:
-                self.bot.send_message(chat_id, "Please provide at least one filter in the caption.")
+            with stage('download'):
+                file_info = self.bot.get_file(job.photo['file_id'])
+                data = self.bot.download_file(file_info.file_path)
+            name = Path(file_info.file_path).name
+
+            try:
+                steps, store_first, first_img_path = prepare_concat_steps(chat_id, steps)
+            except FirstImageMissing:
+                self.bot.send_message(chat_id, "First image not found.")
                 return
 
-            for caption in captions:
-                try:
-                    if caption == 'concat1':
-                        user_dir = Path(f'temp/{chat_id}')
-                        user_dir.mkdir(parents=True, exist_ok=True)
-                        saved_path = img.save_img()
-                        shutil.copy(saved_path, user_dir / 'first_img.jpg')
-                        self.bot.send_message(chat_id, "Send the second image with the direction.")
-                        os.remove(saved_path)
-                        os.remove(img_path)
-                        return
-
-                    if caption.startswith('concat2'):
-                        parts = caption.split()
-                        direction = parts[1] if len(parts) > 1 else 'horizontal'
-                        first_img_path = Path(f'temp/{chat_id}/first_img.jpg')
-                        if not first_img_path.exists():
-                            self.bot.send_message(chat_id, "First image not found.")
-                            return
-                        first_img = Img(str(first_img_path))
-                        img.concat(first_img, direction)
-                        first_img_path.unlink(missing_ok=True)
-                        continue
-
-                    if caption.startswith('blur'):
-                        parts = caption.split()
-                        level = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 16
-                        img.blur(level)
-                    elif caption == 'contour':
-                        img.contour()
-                    elif caption == 'rotate':
-                        img.rotate()
-                    elif caption == 'segment':
-                        img.segment()
-                    elif caption == 'salt and pepper':
-                        img.salt_n_pepper()
-                    elif caption.startswith('concat'):
-                        parts = caption.split()
-                        direction = parts[1] if len(parts) > 1 and parts[1] in ['horizontal', 'vertical'] else 'horizontal'
-                        img.concat(img, direction)
-                    elif caption.startswith('flip'):
-                        parts = caption.split()
-                        direction = parts[1] if len(parts) > 1 else 'vertical'
-                        img.flip(direction)
-                    elif caption == 'invert':
-                        img.invert()
-                    elif caption == 'binary':
-                        img.binary()
-                    elif caption.startswith('pixel'):
-                        parts = caption.split()
-                        level = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 10
-                        img.pixelate(level)
-                    elif caption.startswith('predict'):
-                        show_image = 'show' in caption
-                        predictions = img.predict(chat_id)
-                        self.bot.send_message(chat_id, f"Predictions = {predictions}")
-
-                        s3_key = f"{chat_id}/original/{Path(img_path).name}"
-                        upload_image_to_s3(img_path, s3_key)
-
-                        if show_image:
-                            predicted_path = f"temp/{chat_id}_predicted{Path(img_path).suffix}"
-                            try:
-                                download_predicted_image_from_s3(chat_id, Path(img_path).name, predicted_path)
-                                self.bot.send_photo(chat_id, InputFile(predicted_path))
-                                os.remove(predicted_path)
-                            except Exception as e:
-                                logger.warning(f"Could not fetch predicted image from S3: {e}")
-
-                        return
-                    else:
-                        self.bot.send_message(chat_id, f"Invalid filter: {caption}")
-                        return
-                except RuntimeError as e:
-                    self.bot.send_message(chat_id, f"Error: {str(e)}")
+            if self.filter_pool is None:
+                future = run_inline(run_pipeline, data, steps, name, job.max_dim)
+            else:
+                future = self.filter_pool.submit(run_pipeline, data, steps, name, job.max_dim)
+                if future is None:
+                    self.bot.send_message(chat_id, BUSY_TEXT)
                     return
+            job_started('filter')
+            future.add_done_callback(lambda f: self.on_filtered(chat_id, f, store_first, first_img_path, cache_key))
+            return future
+
+        except Exception as e:
+            logger.error(f"ImageProcessingBot error: {e}")
+            self.bot.send_message(chat_id, "Error processing image.")
+
+    def enqueue(self, chat_id, msg, photo, steps, max_dim=None):
+        """
+        Sends the job to the filter job queue instead of running it here, a worker downloads the photo and replies.
+        """
+        future = self.job_queue.send(job_body(chat_id, msg['message_id'], photo, steps, max_dim))
+        future.add_done_callback(lambda f: self.on_enqueued(chat_id, f))
+        return future
+
+    def on_enqueued(self, chat_id, future):
+        if future.exception() is not None:
+            logger.error(f"Failed to queue filter job: {future.exception()}")
+            self.bot.send_message(chat_id, "Error processing image.")
 
-            processed_path = img.save_img()
-            self.bot.send_photo(chat_id, InputFile(processed_path))
-            os.remove(processed_path)
-            os.remove(img_path)
+    def send_cached(self, chat_id, cached):
+        if cached.file_id:
+            try:
+                self.bot.send_photo(chat_id, cached.file_id)
+                return
+            except Exception as e:
+                logger.warning(f"Could not resend cached file_id, uploading instead: {e}")
+        self.bot.send_photo(chat_id, cached.data)
+
+    def on_filtered(self, chat_id, future, store_first=False, first_img_path=None, cache_key=None):
+        """
+        Completion callback of a filter job, sends the filtered image (or keeps it for concat2).
+        """
+        job_finished('filter')
+        try:
+            try:
+                processed = future.result()
+            except RuntimeError as e:
+                self.bot.send_message(chat_id, f"Error: {str(e)}")
+                return
+
+            if store_first:
+                store_first_image(chat_id, processed)
+                self.bot.send_message(chat_id, "Send the second image with the direction.")
+            else:
+                with stage('send_photo'):
+                    message = self.bot.send_photo(chat_id, processed)
+                if first_img_path:
+                    first_img_path.unlink(missing_ok=True)
+                if cache_key:
+                    self.result_cache.put(cache_key, processed, sent_file_id(message))
 
         except Exception as e:
             logger.error(f"ImageProcessingBot error: {e}")
@@ -197,51 +394,66 @@ class ImageProcessingBot:
 
 
 class ImagePredictionBot:
-    def __init__(self, bot_client):
+    def __init__(self, bot_client, sizing=None):
         self.bot = bot_client
+        self.sizing = sizing or PhotoSizePolicy.from_env()
 
     def send_ai_list(self, chat_id):
-        text = (
-            "AI Features:\n"
-            "*predict* – Detects objects in the image\n"
-            "*predict show* – Detects objects and returns the annotated image"
-        )
-        self.bot.send_message(chat_id, text, parse_mode='Markdown')
+        self.bot.send_message(chat_id, AI_LIST, parse_mode='Markdown')
 
+    @timed('handle_image', bot='predict')
     def handle_image(self, msg, caption='predict'):
         chat_id = msg['chat']['id']
-        show_image = 'show' in caption
-        os.makedirs("temp", exist_ok=True)
-
-        if show_image:
-            msg_id = msg['message_id'] if int(msg['message_id'] % 2 == 0) else str(int(msg['message_id'])+1)
-        else:
-            msg_id = msg['message_id'] if int(msg['message_id'] % 2 == 1) else str(int(msg['message_id'])+1)
+        msg_id = prediction_id(msg, caption)
 
         try:
-            file_info = self.bot.get_file(msg['photo'][-1]['file_id'])
-            data = self.bot.download_file(file_info.file_path)
-            ext = Path(file_info.file_path).suffix or '.jpg'
-
-            suffix = "_show" if show_image else ""
-            tmp_original_path = f"temp/{chat_id}_original{suffix}{ext}"
-
-            with open(tmp_original_path, 'wb') as f:
-                f.write(data)
+            with stage('download'):
+                file_info = self.bot.get_file(self.sizing.select_for_prediction(msg['photo'])['file_id'])
+                data = self.bot.download_file(file_info.file_path)
+
+            s3_key = original_image_key(chat_id, msg_id, file_info.file_path)
+            started = time.perf_counter()
+            job_started('prediction')
+            try:
+                upload_image_bytes_to_s3_in_background(
+                    data, s3_key, lambda error: self.on_uploaded(chat_id, msg_id, error, started))
+            except Exception:
+                # on_uploaded, which finishes the job, will never run
+                job_finished('prediction')
+                raise
 
-            s3_key = f"{chat_id}/original/image_{msg_id}{ext}"
-            upload_image_to_s3(tmp_original_path, s3_key)
-
-            img = Img(tmp_original_path)
-            result = img.predict(chat_id, msg_id)
+            self.bot.send_message(chat_id, "✅ Image received! YOLO is processing it...")
 
-            if result['status'] != "queued":
-                self.bot.send_message(chat_id, f"❌ Failed to queue image: {result.get('error')}")
+        except Exception as e:
+            logger.error(f"ImagePredictionBot error: {e}")
+            self.bot.send_message(chat_id, "❌ Prediction failed, try again later.")
 
-            self.bot.send_message(chat_id, "✅ Image received! YOLO is processing it...")
+    def on_uploaded(self, chat_id, msg_id, error, started=None):
+        """
+        Completion callback of the original's upload, YOLO reads it from S3 so it is queued only now.
+        It runs on an S3 transfer thread, so it only hands the request to the batching producer and returns.
+        """
+        if started is not None:
+            job_finished('prediction')
+            record_stage('s3_upload', time.perf_counter() - started, 'ok' if error is None else 'error')
+        try:
+            if error is not None:
+                raise error
 
-            os.remove(tmp_original_path)
+            sent = time.perf_counter()
+            future = send_prediction_request(chat_id, msg_id)
+            future.add_done_callback(lambda f: self.on_queued(chat_id, f, sent))
 
         except Exception as e:
             logger.error(f"ImagePredictionBot error: {e}")
             self.bot.send_message(chat_id, "❌ Prediction failed, try again later.")
+
+    def on_queued(self, chat_id, future, sent):
+        """
+        Completion callback of the prediction request, called once its SQS batch was sent.
+        """
+        error = future.exception()
+        record_stage('sqs_send', time.perf_counter() - sent, 'ok' if error is None else 'error')
+        if error is not None:
+            logger.error(f"Failed to queue prediction: {error}")
+            self.bot.send_message(chat_id, f"❌ Failed to queue image: {error}")
@@ -0,0 +1,142 @@
+import os
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict, namedtuple
+from loguru import logger
+from polybot.metrics import cache_lookup
+
+CachedResult = namedtuple('CachedResult', ['data', 'file_id'])
+
+
+class ResultCache:
+    """
+    Encoded filter results keyed by (file_unique_id, plan key).
+    Entries live in a size bounded in-memory LRU and, when `disk_dir` is given, in a second size bounded
+    directory tier that survives restarts. Next to the bytes we keep the Telegram file_id of the photo we
+    sent, so a hit can be answered without uploading anything.
+    The directory is listed once, at start up: from then on its files and their total size are tracked
+    in memory, least recently used first, so a write only touches the files it evicts.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, disk_dir=None, disk_max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._disk_files = OrderedDict()
+        self._disk_size = 0
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._scan_disk()
+
+    @staticmethod
+    def make_key(file_unique_id, plan):
+        if not file_unique_id or plan is None:
+            return None
+        return f'{file_unique_id}:{plan}'
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                cache_lookup(True, 'memory')
+                return entry
+        cache_lookup(False, 'memory')
+
+        entry = self._read_disk(key)
+        if self.disk_dir:
+            cache_lookup(entry is not None, 'disk')
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, entry)
+        return entry
+
+    def put(self, key, data, file_id=None):
+        if key is None:
+            return
+        entry = CachedResult(data, file_id)
+        with self._lock:
+            self._store(key, entry)
+        self._write_disk(key, entry)
+
+    def _store(self, key, entry):
+        if len(entry.data) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old.data)
+        self._entries[key] = entry
+        self._size += len(entry.data)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted.data)
+
+    def _scan_disk(self):
+        stats = {}
+        for f in self.disk_dir.iterdir():
+            if not f.suffix:
+                try:
+                    stats[f.name] = f.stat()
+                except FileNotFoundError:
+                    continue
+        for name in sorted(stats, key=lambda name: stats[name].st_mtime):
+            self._disk_files[name] = stats[name].st_size
+            self._disk_size += stats[name].st_size
+
+    def _disk_path(self, key):
+        return self.disk_dir / hashlib.sha256(key.encode()).hexdigest()
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            data = path.read_bytes()
+            id_path = path.with_suffix('.id')
+            file_id = id_path.read_text() if id_path.exists() else None
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._disk_size -= self._disk_files.pop(path.name, 0)
+            return None
+        with self._lock:
+            if path.name in self._disk_files:
+                self._disk_files.move_to_end(path.name)
+        return CachedResult(data, file_id)
+
+    def _write_disk(self, key, entry):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            tmp_path = path.with_suffix('.tmp')
+            tmp_path.write_bytes(entry.data)
+            os.replace(tmp_path, path)
+            if entry.file_id:
+                path.with_suffix('.id').write_text(entry.file_id)
+        except OSError as e:
+            logger.warning(f"Could not write result cache entry: {e}")
+            return
+        with self._lock:
+            self._disk_size += len(entry.data) - self._disk_files.pop(path.name, 0)
+            self._disk_files[path.name] = len(entry.data)
+            evicted = []
+            while self._disk_size > self.disk_max_bytes and self._disk_files:
+                name, size = self._disk_files.popitem(last=False)
+                self._disk_size -= size
+                evicted.append(self.disk_dir / name)
+        for f in evicted:
+            f.unlink(missing_ok=True)
+            f.with_suffix('.id').unlink(missing_ok=True)
@@ -0,0 +1,54 @@
+import io
+import os
+from pathlib import Path
+import numpy as np
+from PIL import Image
+
+# JPEG quality (1-95, 75 is what matplotlib wrote) and PNG zlib level (0-9, higher is smaller but slower)
+# of the filtered images
+JPEG_QUALITY = int(os.getenv('IMG_JPEG_QUALITY', 75))
+PNG_COMPRESS_LEVEL = int(os.getenv('IMG_PNG_COMPRESS_LEVEL', 6))
+
+
+def image_format(path):
+    return Path(path).suffix.lstrip('.').lower() or 'jpeg'
+
+
+def load_gray(source, max_dim=None):
+    """
+    Decodes an image file (path or file object) straight to an 8-bit grayscale array.
+    JPEGs are decoded to luma only and, with `max_dim`, at the smallest DCT scale (1/2, 1/4, 1/8) that still
+    covers it, so the full resolution RGB image never exists in memory. What is left is resized to fit `max_dim`.
+    """
+    with Image.open(source) as image:
+        image.draft('L', (max_dim, max_dim) if max_dim else image.size)
+        gray = image.convert('L')
+    if max_dim and max(gray.size) > max_dim:
+        gray.thumbnail((max_dim, max_dim), Image.Resampling.BOX)
+    return np.asarray(gray)
+
+
+def save_options(fmt):
+    """
+    The PIL format name and save options for a format or file suffix (jpg, jpeg, png...).
+    """
+    name = Image.registered_extensions().get(f'.{fmt.lower()}', fmt.upper())
+    if name == 'JPEG':
+        return name, {'quality': JPEG_QUALITY}
+    if name == 'PNG':
+        return name, {'compress_level': PNG_COMPRESS_LEVEL}
+    return name, {}
+
+
+def save_gray(pixels, target, fmt):
+    """
+    Encodes a uint8 array as a single channel grayscale image into `target`, a path or a file object.
+    """
+    name, options = save_options(fmt)
+    Image.fromarray(np.ascontiguousarray(pixels), 'L').save(target, format=name, **options)
+
+
+def encode_gray(pixels, fmt='jpeg'):
+    buffer = io.BytesIO()
+    save_gray(pixels, buffer, fmt)
+    return buffer.getvalue()
@@ -1,78 +1,80 @@
 import os
-import json
-import time
-import boto3
 from loguru import logger
 from telebot import TeleBot
-from telebot.types import InputFile
 from pathlib import Path
-from polybot.s3 import download_predicted_image_from_s3
+from polybot.s3 import (predicted_images_from_event, read_predicted_image_from_s3, read_s3_object,
+                        wait_for_predicted_image)
+from polybot.sqs_consumer import SQSConsumer
+from polybot.bot import sends_predicted_image
+from polybot.aws import get_client
+from polybot.metrics import setup_metrics, stage, timed
+from polybot.profiling import profiled
 
 # === Config ===
 AWS_REGION = os.environ.get('AWS_REGION', 'us-west-2')
-QUEUE_URL = 'https://sqs.us-west-2.amazonaws.com/228281126655/ameer-polybot-chat-messages'
+QUEUE_URL = os.environ.get('CONSUMER_QUEUE_URL', 'https://sqs.us-west-2.amazonaws.com/228281126655/ameer-polybot-chat-messages')
 TELEGRAM_TOKEN = os.environ['TELEGRAM_BOT_TOKEN']
 
-sqs = boto3.client('sqs', region_name=AWS_REGION)
+# SQS_ENDPOINT_URL points the consumer at a local SQS stand-in (ElasticMQ, LocalStack)
+sqs = get_client('sqs', AWS_REGION)
 bot = TeleBot(TELEGRAM_TOKEN)
 
 
+def send_prediction(chat_id, predicted: bytes):
+    with stage('send_photo'):
+        bot.send_photo(chat_id, predicted)
+    bot.send_message(chat_id, "✅ Your prediction is ready!")
+    logger.info(f"Finished processing message for chat_id: {chat_id}")
+
+
+@timed('handle_message')
 def handle_message(msg_body: dict):
+    with profiled('handle_message', chat_id=msg_body.get('chat_id'), image=msg_body.get('image_s3_key')) as tags:
+        _handle_message(msg_body, tags)
+
+
+def _handle_message(msg_body: dict, tags: dict):
+    # === S3 event notification: the predicted image is known to exist ===
+    if 'Records' in msg_body:
+        for chat_id, image_id, s3_key in predicted_images_from_event(msg_body):
+            tags.update(chat_id=chat_id, image=s3_key)
+            logger.info(f"Predicted image {s3_key} created for chat_id: {chat_id}")
+            if not sends_predicted_image(image_id, 'event'):
+                continue
+            with stage('s3_read'):
+                predicted = read_s3_object(s3_key)
+            send_prediction(chat_id, predicted)
+        return
+
+    # e.g. the s3:TestEvent S3 sends when the notification is set up, acknowledged so it isn't redelivered forever
+    if 'chat_id' not in msg_body or 'image_s3_key' not in msg_body:
+        logger.warning(f"Ignoring unrecognized message: {msg_body}")
+        return
+
     chat_id = msg_body['chat_id']
     s3_key = msg_body['image_s3_key']
 
     logger.info(f"Processing message for chat_id: {chat_id}")
 
-    # === 1) Wait for YOLO to finish processing ===
-    predicted_path = f"temp/{chat_id}_predicted.jpg"
+    # === No event for this one, fall back to waiting for YOLO with cheap HEAD checks ===
     image_name = Path(s3_key).name
-    Path("temp").mkdir(exist_ok=True)
-
-    max_wait_seconds = 30  # adjust as needed
-    poll_interval = 2
-    waited = 0
-
-    while waited < max_wait_seconds:
-        try:
-            download_predicted_image_from_s3(chat_id, image_name, predicted_path)
-            logger.info("Predicted image found and downloaded.")
-            break  # success!
-        except Exception as e:
-            logger.info(f"Predicted image not ready yet. Waiting... ({waited}s)")
-            time.sleep(poll_interval)
-            waited += poll_interval
-    else:
+    with stage('s3_wait'):
+        ready = wait_for_predicted_image(chat_id, image_name, timeout=int(os.getenv('PREDICTION_WAIT_SECONDS', 30)))
+    if not ready:
         bot.send_message(chat_id, "⚠️ Sorry, prediction is still not ready. Please try again later.")
         return
 
-    # === 2) Send predicted image to user ===
-    bot.send_photo(chat_id, InputFile(predicted_path))
-    bot.send_message(chat_id, "✅ Your prediction is ready!")
-
-    # === 3) Cleanup ===
-    os.remove(predicted_path)
-    logger.info(f"Finished processing message for chat_id: {chat_id}")
-
-
-while True:
-    response = sqs.receive_message(
-        QueueUrl=QUEUE_URL,
-        MaxNumberOfMessages=5,
-        WaitTimeSeconds=20
-    )
-
-    messages = response.get('Messages', [])
-
-    for msg in messages:
-        msg_body = json.loads(msg['Body'])
-        handle_message(msg_body)
+    with stage('s3_read'):
+        predicted = read_predicted_image_from_s3(chat_id, image_name)
+    send_prediction(chat_id, predicted)
 
-        # Delete message after successful processing
-        sqs.delete_message(
-            QueueUrl=QUEUE_URL,
-            ReceiptHandle=msg['ReceiptHandle']
-        )
-        logger.info(f"Message deleted: {msg['MessageId']}")
 
-    if not messages:
-        time.sleep(1)
+if __name__ == '__main__':
+    setup_metrics('polybot-consumer')
+    SQSConsumer(
+        sqs,
+        QUEUE_URL,
+        handle_message,
+        workers=int(os.getenv('CONSUMER_WORKERS', 4)),
+        visibility_timeout=int(os.getenv('SQS_VISIBILITY_TIMEOUT', 60)),
+    ).run()
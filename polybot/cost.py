@@ -0,0 +1,168 @@
+import os
+import math
+from collections import namedtuple
+from polybot.img_proc import MAX_DIMENSION
+from polybot.pipeline import InvalidFilterError, Step, parse_caption
+
+# seconds per megapixel of each stage and bytes per pixel it allocates on top of the pixels themselves,
+# measured with polybot.bench (see bench/baseline.json), pixelate adds a per block part on top
+SECONDS_PER_MEGAPIXEL = {
+    'decode': 0.008, 'encode': 0.005,
+    'blur': 0.012, 'pixelate': 0.010, 'contour': 0.0012, 'salt_n_pepper': 0.031, 'concat': 0.0008,
+    'segment': 0.0006, 'binary': 0.0006, 'invert': 0.0002, 'rotate': 0, 'flip': 0,
+}
+SCRATCH_BYTES_PER_PIXEL = {
+    'decode': 2, 'encode': 2,
+    'blur': 4, 'pixelate': 4, 'contour': 1, 'salt_n_pepper': 8, 'segment': 1, 'binary': 1,
+}
+# filters whose level is a distance in pixels, it is scaled with the photo so the result looks the same
+SCALED_LEVEL_FILTERS = ('blur', 'pixelate')
+PIXELATE_BLOCK_SECONDS = 0.058
+PIXELATE_BLOCK_BYTES = 32
+
+PlanCost = namedtuple('PlanCost', ['seconds', 'peak_bytes', 'width', 'height'])
+
+ACCEPT = 'accept'
+LOW_PRIORITY = 'low_priority'
+DOWNSCALE = 'downscale'
+REJECT = 'reject'
+Decision = namedtuple('Decision', ['action', 'cost', 'max_dim'])
+
+
+def scale_steps(steps, scale):
+    """
+    The steps with blur and pixelate levels scaled, so that on an image `scale` times the size they look the same.
+    """
+    return [Step(step.name, (max(1, round(step.args[0] * scale)),)) if step.name in SCALED_LEVEL_FILTERS else step
+            for step in steps]
+
+
+def fit(width, height, max_dim):
+    """
+    The size of a width x height image scaled down (never up) to fit in max_dim x max_dim.
+    """
+    if not max_dim or max(width, height) <= max_dim:
+        return width, height
+    scale = max_dim / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def estimate(steps, width, height):
+    """
+    Estimated CPU seconds and peak memory of decoding a width x height photo, running `steps` on it and encoding
+    the result, together with the size of the result. Only the plan and the photo size are needed,
+    which Telegram sends with the message, so this runs before anything is downloaded.
+    """
+    seconds = 0.0
+    n, m = height, width
+    buffer = n * m
+    peak = buffer + buffer * SCRATCH_BYTES_PER_PIXEL['decode']
+    seconds += buffer / 1e6 * SECONDS_PER_MEGAPIXEL['decode']
+
+    for step in steps:
+        name = step.name
+        if name == 'concat1':
+            break
+        pixels = n * m
+        scratch = pixels * SCRATCH_BYTES_PER_PIXEL.get(name, 0)
+        seconds += pixels / 1e6 * SECONDS_PER_MEGAPIXEL.get(name, 0)
+
+        if name == 'blur':
+            level = step.args[0]
+            n, m = max(n - level + 1, 1), max(m - level + 1, 1)
+            if pixels * 255 >= 2 ** 32:
+                scratch *= 2
+        elif name == 'pixelate':
+            level = step.args[0]
+            seconds += pixels / 1e6 * PIXELATE_BLOCK_SECONDS / level ** 2
+            scratch += pixels * PIXELATE_BLOCK_BYTES // level ** 2
+        elif name == 'contour':
+            m = max(m - 1, 1)
+        elif name == 'rotate':
+            n, m = m, n
+        elif name in ('concat', 'concat2'):
+            if step.args[0] == 'vertical':
+                n *= 2
+            else:
+                m *= 2
+            # the joined image is a new buffer, the old one is freed after the copy
+            scratch = buffer
+            buffer = n * m
+        peak = max(peak, buffer + scratch)
+
+    seconds += n * m / 1e6 * SECONDS_PER_MEGAPIXEL['encode']
+    peak = max(peak, buffer + n * m * SCRATCH_BYTES_PER_PIXEL['encode'])
+    return PlanCost(seconds, peak, m, n)
+
+
+def photo_size(photo):
+    return photo.get('width', 0), photo.get('height', 0)
+
+
+class AdmissionPolicy:
+    """
+    Decides, from the estimated cost, what to do with a filter job before its photo is downloaded:
+    accept it, put it in the low priority lane (slower than `low_priority_seconds`), or, when it is over
+    `max_seconds` or `max_bytes`, run it on a photo downscaled until it fits, or reject it when that would
+    have to go below `min_dim`. concat1/concat2 plans are never downscaled: the first photo is stored at the size
+    it was decoded at and the second one has to match it.
+    """
+
+    def __init__(self, max_seconds=10, max_bytes=512 * 1024 * 1024, low_priority_seconds=2, min_dim=256,
+                 max_dim=MAX_DIMENSION):
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.low_priority_seconds = low_priority_seconds
+        self.min_dim = min_dim
+        self.max_dim = max_dim
+
+    @classmethod
+    def from_env(cls):
+        """
+        JOB_MAX_SECONDS, JOB_MAX_MEMORY_MB, JOB_LOW_PRIORITY_SECONDS and JOB_MIN_DIMENSION.
+        """
+        return cls(float(os.getenv('JOB_MAX_SECONDS', 10)),
+                   int(os.getenv('JOB_MAX_MEMORY_MB', 512)) * 1024 * 1024,
+                   float(os.getenv('JOB_LOW_PRIORITY_SECONDS', 2)),
+                   int(os.getenv('JOB_MIN_DIMENSION', 256)))
+
+    def fits(self, cost):
+        return cost.seconds <= self.max_seconds and cost.peak_bytes <= self.max_bytes
+
+    def decide(self, steps, width, height):
+        # photos larger than IMG_MAX_DIMENSION are downscaled while decoding anyway
+        width, height = fit(width, height, self.max_dim)
+        cost = estimate(steps, width, height)
+        if self.fits(cost):
+            return Decision(LOW_PRIORITY if cost.seconds > self.low_priority_seconds else ACCEPT, cost, None)
+        if any(step.name in ('concat1', 'concat2') for step in steps):
+            return Decision(REJECT, cost, None)
+
+        # cost grows about linearly with the number of pixels, shrink both sides by the square root of the excess
+        excess = max(cost.seconds / self.max_seconds, cost.peak_bytes / self.max_bytes)
+        max_dim = int(max(width, height) / math.sqrt(excess))
+        while max_dim >= self.min_dim:
+            # the levels are scaled with the photo, see scale_steps
+            downscaled = estimate(scale_steps(steps, max_dim / max(width, height)), *fit(width, height, max_dim))
+            if self.fits(downscaled):
+                action = LOW_PRIORITY if downscaled.seconds > self.low_priority_seconds else DOWNSCALE
+                return Decision(action, downscaled, max_dim)
+            max_dim = int(max_dim * 0.9)
+        return Decision(REJECT, cost, None)
+
+    def decide_message(self, msg, sizing=None):
+        """
+        The decision for a photo message, None when it is not a filter job (a prediction or an invalid caption).
+        With a `sizing` policy the decision is for the photo size it picks instead of the largest one.
+        """
+        caption = msg.get('caption', '').strip().lower()
+        if caption.startswith('predict'):
+            return None
+        try:
+            steps = parse_caption(caption)
+        except InvalidFilterError:
+            return None
+        photo = msg['photo'][-1]
+        if sizing is not None:
+            photo, steps = sizing.select(msg['photo'], steps)
+        return self.decide(steps, *photo_size(photo))
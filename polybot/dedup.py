@@ -0,0 +1,130 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from loguru import logger
+from polybot.aws import get_client
+
+
+def update_keys(update):
+    """
+    The keys a Telegram update is known by: its update_id and the (chat_id, message_id) of its message.
+    """
+    keys = []
+    if 'update_id' in update:
+        keys.append(f"update:{update['update_id']}")
+    msg = update.get('message') or {}
+    if 'message_id' in msg and 'chat' in msg:
+        keys.append(f"message:{msg['chat']['id']}:{msg['message_id']}")
+    return keys
+
+
+class DynamoDBClaims:
+    """
+    Keys claimed by any process, as items of a DynamoDB table with a string partition key `key`.
+    A conditional put claims a key only if it is new or expired. Enable TTL on `expires_at` so the table
+    cleans itself up.
+    """
+
+    def __init__(self, dynamodb, table):
+        self.dynamodb = dynamodb
+        self.table = table
+
+    def claim(self, key, ttl):
+        """
+        Returns True if this call claimed `key` for `ttl` seconds, False if another one holds it.
+        """
+        from botocore.exceptions import ClientError
+        now = int(time.time())
+        try:
+            self.dynamodb.put_item(
+                TableName=self.table,
+                Item={'key': {'S': key}, 'expires_at': {'N': str(now + int(ttl))}},
+                # TTL deletes expired items only eventually, until then they don't count
+                ConditionExpression='attribute_not_exists(#key) OR expires_at < :now',
+                ExpressionAttributeNames={'#key': 'key'},
+                ExpressionAttributeValues={':now': {'N': str(now)}},
+            )
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def release(self, key):
+        self.dynamodb.delete_item(TableName=self.table, Key={'key': {'S': key}})
+
+
+class DedupIndex:
+    """
+    Remembers the Telegram updates already taken for `ttl` seconds, at most `max_entries` keys, so the webhook
+    acknowledges redelivered updates without running their job again. Telegram redelivers an update when
+    the webhook was too slow to answer, sending the same update_id, and a message may come in twice under
+    different updates, hence the (chat_id, message_id) key too.
+
+    With `claims` (e.g. DynamoDBClaims) the keys of an update not seen here are also claimed there,
+    so replicas behind a load balancer agree on who takes it. If that store fails the update is taken anyway:
+    running a job twice beats dropping it.
+    """
+
+    def __init__(self, ttl=600, max_entries=100000, claims=None, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.claims = claims
+        self.clock = clock
+        self._expiry = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        WEBHOOK_DEDUP_TTL (seconds) and WEBHOOK_DEDUP_MAX bound the index,
+        WEBHOOK_DEDUP_TABLE names a DynamoDB table shared by all the replicas.
+        """
+        table = os.getenv('WEBHOOK_DEDUP_TABLE')
+        claims = DynamoDBClaims(get_client('dynamodb', os.getenv('AWS_REGION')), table) if table else None
+        return cls(int(os.getenv('WEBHOOK_DEDUP_TTL', 600)), int(os.getenv('WEBHOOK_DEDUP_MAX', 100000)), claims)
+
+    def _expire(self, now):
+        # every key lives `ttl` seconds, so insertion order is expiry order
+        while self._expiry and (next(iter(self._expiry.values())) <= now or len(self._expiry) > self.max_entries):
+            self._expiry.popitem(last=False)
+
+    def first_seen(self, update):
+        """
+        Records the update and returns True the first time it is seen, False for a duplicate.
+        """
+        keys = update_keys(update)
+        if not keys:
+            return True
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            if any(key in self._expiry for key in keys):
+                return False
+            for key in keys:
+                self._expiry[key] = now + self.ttl
+            self._expire(now)
+
+        if self.claims is not None:
+            try:
+                return all(self.claims.claim(key, self.ttl) for key in keys)
+            except Exception as e:
+                logger.warning(f"Dedup store failed, taking update {keys[0]} anyway: {e}")
+        return True
+
+    def release(self, update):
+        """
+        Forgets an update taken by first_seen whose job failed, so Telegram's retry of it is taken again.
+        """
+        keys = update_keys(update)
+        with self._lock:
+            for key in keys:
+                self._expiry.pop(key, None)
+
+        if self.claims is not None:
+            try:
+                for key in keys:
+                    self.claims.release(key)
+            except Exception as e:
+                logger.warning(f"Dedup store failed, update {keys[0]} stays claimed until it expires: {e}")
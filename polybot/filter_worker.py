@@ -0,0 +1,32 @@
+import os
+from telebot import TeleBot
+from polybot.sqs_consumer import SQSConsumer
+from polybot.aws import get_client
+from polybot.workers import FilterPool
+from polybot.jobs import FilterJobHandler, MemoryLedger, S3Ledger
+from polybot.metrics import setup_metrics
+
+# === Config ===
+AWS_REGION = os.environ.get('AWS_REGION', 'us-west-2')
+QUEUE_URL = os.environ['FILTER_QUEUE_URL']
+TELEGRAM_TOKEN = os.environ['TELEGRAM_BOT_TOKEN']
+# replies are recorded in this bucket so every node skips the jobs another one already replied to
+LEDGER_BUCKET = os.getenv('FILTER_LEDGER_BUCKET') or os.getenv('AWS_S3_BUCKET')
+
+
+if __name__ == '__main__':
+    setup_metrics('polybot-filter-worker')
+    filter_pool = FilterPool(int(os.getenv('FILTER_WORKERS', 0)) or None, int(os.getenv('FILTER_MAX_PENDING', 0)) or None)
+    ledger = S3Ledger(get_client('s3', AWS_REGION), LEDGER_BUCKET) if LEDGER_BUCKET else MemoryLedger()
+    handler = FilterJobHandler(TeleBot(TELEGRAM_TOKEN), ledger, filter_pool)
+    SQSConsumer(
+        get_client('sqs', AWS_REGION),
+        QUEUE_URL,
+        handler,
+        # one message per filter process, the others wait in the queue for another node
+        workers=filter_pool.max_workers,
+        visibility_timeout=int(os.getenv('SQS_VISIBILITY_TIMEOUT', 60)),
+        # a job that failed this many times is replied to with an error and dropped
+        max_receives=int(os.getenv('FILTER_MAX_RECEIVES', 5)),
+        on_give_up=handler.give_up,
+    ).run()
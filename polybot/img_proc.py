@@ -1,172 +1,380 @@
+import io
 from pathlib import Path
-import random
-import requests
-import boto3
-import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from matplotlib.image import imread, imsave
+import numpy as np
+from polybot.codec import load_gray, image_format, save_gray, encode_gray
+from polybot.sqs_producer import get_producer
+from polybot.metrics import stage, timed
 
 
-def rgb2gray(rgb):
-    r, g, b = rgb[:, :, 0], rgb[:, :, 1], rgb[:, :, 2]
-    gray = 0.2989 * r + 0.5870 * g + 0.1140 * b
-    return gray
+# images larger than this (in either dimension) are downscaled while decoding, 0 keeps the full resolution
+MAX_DIMENSION = int(os.getenv('IMG_MAX_DIMENSION', 0)) or None
+
+# blur works through the image in bands of about this many pixels, so its scratch space stays small
+BAND_PIXELS = 1 << 18
+
+# blur, contour and pixelate split images of at least IMG_TILE_MIN_PIXELS into row bands run on
+# IMG_TILE_WORKERS threads (numpy releases the GIL in its loops). Off by default: the filter pool already
+# keeps every core busy with one job per process, lower FILTER_WORKERS when turning this on
+TILE_WORKERS = int(os.getenv('IMG_TILE_WORKERS', 1))
+TILE_MIN_PIXELS = int(os.getenv('IMG_TILE_MIN_PIXELS', 1 << 22))
+
+_tile_pool = None
+_tile_lock = threading.Lock()
+
+
+def integral_image(pixels, table=None):
+    """
+    Summed-area table of `pixels`, padded with a leading row and column of zeros,
+    so the sum of pixels[r0:r1, c0:c1] is table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0].
+    The table holds exact integers, uint32 whenever the total of the image fits in it.
+    `table` is reused when it is an array of the right shape and dtype.
+    """
+    n, m = pixels.shape
+    dtype = np.uint32 if n * m * 255 < 2 ** 32 else np.uint64
+    if table is None or table.shape != (n + 1, m + 1) or table.dtype != dtype:
+        table = np.empty((n + 1, m + 1), dtype=dtype)
+    table[0] = 0
+    table[:, 0] = 0
+    # built in bands of rows, an in-place cumsum over the whole table would copy all of it
+    band = max(1, BAND_PIXELS // m)
+    for r0 in range(0, n, band):
+        r1 = min(r0 + band, n)
+        rows = table[r0 + 1:r1 + 1, 1:]
+        np.cumsum(pixels[r0:r1], axis=1, dtype=dtype, out=rows)
+        np.cumsum(rows, axis=0, out=rows)
+        rows += table[r0, 1:]
+    return table
+
+
+def box_sums(table, row_starts, row_ends, col_starts, col_ends):
+    """
+    Sums of the boxes [row_start:row_end, col_start:col_end] for every combination of the given row and column ranges.
+    Unsigned differences may wrap in between, the final sums are exact.
+    """
+    top, bottom = table[row_starts], table[row_ends]
+    return (bottom[:, col_ends] - top[:, col_ends]) - (bottom[:, col_starts] - top[:, col_starts])
+
+
+def box_blur(table, k, out, scratch=np.empty):
+    """
+    Writes the floored k x k box averages of the image `table` is the summed-area table of into `out`,
+    whose rows are the windows starting at the table's rows. Works in bands, `scratch(shape, dtype)` gives their sums.
+    """
+    out_n, out_m = out.shape
+    band = max(1, BAND_PIXELS // out_m)
+    for r0 in range(0, out_n, band):
+        r1 = min(r0 + band, out_n)
+        sums = scratch((r1 - r0, out_m), table.dtype)
+        np.subtract(table[r0 + k:r1 + k, k:], table[r0:r1, k:], out=sums)
+        sums -= table[r0 + k:r1 + k, :out_m]
+        sums += table[r0:r1, :out_m]
+        sums //= k * k
+        out[r0:r1] = sums
+
+
+def edge_strength(pixels, high):
+    """
+    Replaces pixels[:, :-1] with the absolute difference of each pixel and its right neighbour, `high` is scratch
+    of that shape. Rows are independent, so bands of rows can be done separately.
+    """
+    left, right = pixels[:, :-1], pixels[:, 1:]
+    np.maximum(left, right, out=high)
+    np.minimum(left, right, out=left)
+    np.subtract(high, left, out=left)
+
+
+def pixelate_rows(pixels, table, level):
+    """
+    Replaces every level x level block of `pixels` (the last ones may be smaller) with its floored average,
+    `table` is the summed-area table of `pixels`.
+    """
+    n, m = pixels.shape
+    row_starts = np.arange(0, n, level)
+    col_starts = np.arange(0, m, level)
+    row_ends = np.minimum(row_starts + level, n)
+    col_ends = np.minimum(col_starts + level, m)
+
+    block_sums = box_sums(table, row_starts, row_ends, col_starts, col_ends)
+    block_rows, block_cols = row_ends - row_starts, col_ends - col_starts
+    block_avg = (block_sums // np.outer(block_rows, block_cols)).astype(np.uint8)
+
+    for block_row, r0, r1 in zip(block_avg, row_starts, row_ends):
+        pixels[r0:r1] = np.repeat(block_row, block_cols)
+
+
+def row_bands(n, tiles, align=1):
+    """
+    Splits rows 0..n into at most `tiles` bands of about the same height, each starting at a multiple of `align`.
+    """
+    height = -(-n // tiles)
+    height = -(-height // align) * align
+    return [(r0, min(r0 + height, n)) for r0 in range(0, n, height)]
+
+
+def run_tiles(fn, bands):
+    """
+    Runs fn(r0, r1) for every band on the tile threads and waits for all of them.
+    """
+    global _tile_pool
+    with _tile_lock:
+        if _tile_pool is None:
+            _tile_pool = ThreadPoolExecutor(TILE_WORKERS, thread_name_prefix='img-tile')
+    for future in [_tile_pool.submit(fn, r0, r1) for r0, r1 in bands]:
+        future.result()
+
+
+def _forget_tile_pool():
+    global _tile_pool
+    _tile_pool = None
+
+
+# the tile threads do not survive a fork into the filter pool
+os.register_at_fork(after_in_child=_forget_tile_pool)
+
+
+def as_pixels(value):
+    """
+    Copies `value` (nested lists or an array) into a fresh uint8 array, rounding and clipping to 0..255.
+    """
+    array = np.asarray(value)
+    if array.dtype == np.uint8:
+        return array.copy()
+    return np.clip(np.rint(array), 0, 255).astype(np.uint8)
 
 
 class Img:
-    def __init__(self, path):
+    def __init__(self, path, max_dim=MAX_DIMENSION):
         """
         Do not change the constructor implementation
         """
         self.path = Path(path)
-        self.data = rgb2gray(imread(path)).tolist()
+        self.data = load_gray(path, max_dim)
+
+    @classmethod
+    def from_bytes(cls, data, name='image.jpg', max_dim=MAX_DIMENSION):
+        """
+        Decodes an encoded image (e.g. a Telegram download) straight from memory.
+        `name` is only used for its suffix, which picks the output format.
+        """
+        img = cls.__new__(cls)
+        img.path = Path(name)
+        with stage('decode'):
+            img.data = load_gray(io.BytesIO(data), max_dim)
+        return img
+
+    @classmethod
+    def from_pixels(cls, pixels, name='image.png'):
+        """
+        An image holding a copy of `pixels` (nested lists or an array of gray levels).
+        """
+        img = cls.__new__(cls)
+        img.path = Path(name)
+        img.data = pixels
+        return img
+
+    @property
+    def data(self):
+        """
+        The image pixels as a list of rows. Filters work on `self.pixels`, the list is only built on access.
+        """
+        if self._rows is None:
+            self._rows = self.pixels.tolist()
+        return self._rows
+
+    @data.setter
+    def data(self, value):
+        self._set_pixels(as_pixels(value))
+
+    def _set_pixels(self, pixels):
+        """
+        Adopts `pixels` without copying. It may be a strided view (a flip, a crop) of a buffer this image owns,
+        filters write through it in place.
+        """
+        self.pixels = pixels
+        self._rows = None
+
+    def _changed(self):
+        self._rows = None
+
+    def _scratch(self, shape, dtype=np.uint8):
+        """
+        A scratch array of `shape`, carved out of one flat buffer that is kept between filters and only grows.
+        """
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        buffer = getattr(self, '_scratch_buffer', None)
+        if buffer is None or buffer.size < size:
+            buffer = self._scratch_buffer = np.empty(size, dtype=np.uint8)
+        return buffer[:size].view(dtype).reshape(shape)
+
+    def _tiles(self):
+        """
+        How many row bands the neighbourhood filters split this image into, 1 runs them in the calling thread.
+        """
+        return TILE_WORKERS if TILE_WORKERS > 1 and self.pixels.size >= TILE_MIN_PIXELS else 1
 
     def save_img(self):
         """
         Do not change the below implementation
         """
         new_path = self.path.with_name(self.path.stem + '_filtered' + self.path.suffix)
-        imsave(new_path, self.data, cmap='gray')
+        save_gray(self.pixels, new_path, image_format(new_path))
         return new_path
 
+    def to_bytes(self, fmt=None):
+        """
+        Encodes the image the same way save_img does, but into memory.
+        """
+        with stage('encode'):
+            return encode_gray(self.pixels, fmt or image_format(self.path))
+
+    @timed('filter')
     def blur(self, blur_level=16):
-        n, m = len(self.data), len(self.data[0])
+        n, m = self.pixels.shape
         if blur_level <= 0 or blur_level >= min(n, m):
             raise RuntimeError(f"Invalid blur level!")
-        height = len(self.data)
-        width = len(self.data[0])
-        filter_sum = blur_level ** 2
+        k = blur_level
+        out_n, out_m = n - k + 1, m - k + 1
 
-        result = []
-        for i in range(height - blur_level + 1):
-            row_result = []
-            for j in range(width - blur_level + 1):
-                sub_matrix = [row[j:j + blur_level] for row in self.data[i:i + blur_level]]
-                average = sum(sum(sub_row) for sub_row in sub_matrix) // filter_sum
-                row_result.append(average)
-            result.append(row_result)
+        tiles = self._tiles()
+        if tiles == 1:
+            # the table keeps everything blur needs, so the result is written over the top left corner of the pixels
+            box_blur(integral_image(self.pixels), k, self.pixels[:out_n, :out_m], self._scratch)
+            self._set_pixels(self.pixels[:out_n, :out_m])
+            return
 
-        self.data = result
+        # output rows r0..r1 are the windows over input rows r0..r1 + k - 1, the bands overlap by that halo
+        # so they need a separate output
+        out = np.empty((out_n, out_m), np.uint8)
+        run_tiles(lambda r0, r1: box_blur(integral_image(self.pixels[r0:r1 + k - 1]), k, out[r0:r1]),
+                  row_bands(out_n, tiles))
+        self._set_pixels(out)
 
+    @timed('filter')
     def contour(self):
-        for i, row in enumerate(self.data):
-            res = []
-            for j in range(1, len(row)):
-                res.append(abs(row[j-1] - row[j]))
-
-            self.data[i] = res
+        n, m = self.pixels.shape
+        tiles = self._tiles()
+        if tiles == 1:
+            edge_strength(self.pixels, self._scratch((n, m - 1)))
+        else:
+            # contour only looks along rows, the bands need no halo
+            run_tiles(lambda r0, r1: edge_strength(self.pixels[r0:r1], np.empty((r1 - r0, m - 1), np.uint8)),
+                      row_bands(n, tiles))
+        self._set_pixels(self.pixels[:, :-1])
 
+    @timed('filter')
     def rotate(self):
-        n, m = len(self.data), len(self.data[0])
-        rotated = [[0] * n for _ in range(m)]
-
-        for i in range(n):
-            for j in range(m):
-                rotated[j][n - 1 - i] = self.data[i][j]
-
-        self.data = rotated
+        self._set_pixels(self.pixels[::-1].T)
 
+    @timed('filter')
     def salt_n_pepper(self):
-        n, m = len(self.data), len(self.data[0])
-        for i in range(n):
-            for j in range(m):
-                rand = random.random()
-                if rand < 0.2:
-                    self.data[i][j] = 255
-                elif rand > 0.8:
-                    self.data[i][j] = 0
+        rand = np.random.random(self.pixels.shape)
+        self.pixels[rand < 0.2] = 255
+        self.pixels[rand > 0.8] = 0
+        self._changed()
 
+    @timed('filter')
     def concat(self, other_img, direction='horizontal'):
-        n1, m1 = len(self.data), len(self.data[0])
-        n2, m2 = len(other_img.data), len(other_img.data[0])
+        n1, m1 = self.pixels.shape
+        n2, m2 = other_img.pixels.shape
 
         if direction == 'horizontal':
             if n1 != n2:
                 raise RuntimeError("Cannot concatenate horizontally: image heights are different.")
-            concat_image = [[0] * (m1 + m2) for _ in range(n1)]
-            for i in range(n1):
-                for j in range(m1 + m2):
-                    concat_image[i][j] = self.data[i][j] if j < m1 else other_img.data[i][j - m1]
-            self.data = concat_image
+            self._set_pixels(np.hstack((self.pixels, other_img.pixels)))
 
         elif direction == 'vertical':
             if m1 != m2:
                 raise RuntimeError("Cannot concatenate vertically: image widths are different.")
-            concat_image = [[0] * m1 for _ in range(n1+n2)]
-            for i in range(n1 + n2):
-                for j in range(m1):
-                    concat_image[i][j] = self.data[i][j] if i < n1 else other_img.data[i - n1][j]
-            self.data = concat_image
+            self._set_pixels(np.vstack((self.pixels, other_img.pixels)))
+
+    def _threshold(self, threshold):
+        mask = np.greater(self.pixels, threshold, out=self._scratch(self.pixels.shape, np.bool_))
+        np.multiply(mask, np.uint8(255), out=self.pixels)
+        self._changed()
 
+    @timed('filter')
     def segment(self):
-        n, m = len(self.data), len(self.data[0])
-        for i in range(n):
-            for j in range(m):
-                if self.data[i][j] > 100:
-                    self.data[i][j] = 255
-                else:
-                    self.data[i][j] = 0
+        self._threshold(100)
 
+    @timed('filter')
     def invert(self):
-        n, m = len(self.data), len(self.data[0])
-        for i in range(n):
-            for j in range(m):
-                self.data[i][j] = 255 - self.data[i][j]
+        np.subtract(np.uint8(255), self.pixels, out=self.pixels)
+        self._changed()
 
+    @timed('filter')
     def binary(self):
-        n, m = len(self.data), len(self.data[0])
-        for i in range(n):
-            for j in range(m):
-                if self.data[i][j] > 127:
-                    self.data[i][j] = 255
-                else:
-                    self.data[i][j] = 0
+        self._threshold(127)
 
+    @timed('filter')
     def flip(self, direction='vertical'):
-        n, m = len(self.data), len(self.data[0])
-
         if direction == 'vertical':
-            for i in range(n):
-                for j in range(m // 2):
-                    self.data[i][j], self.data[i][m - j - 1] = self.data[i][m - j - 1], self.data[i][j]
+            self._set_pixels(self.pixels[:, ::-1])
 
         elif direction == 'horizontal':
-            for i in range(n // 2):
-                for j in range(m):
-                    self.data[i][j], self.data[n - i - 1][j] = self.data[n - i - 1][j], self.data[i][j]
+            self._set_pixels(self.pixels[::-1])
+
+    @timed('filter')
+    def transform(self, rotations, flipped):
+        """
+        Flips the rows first if `flipped`, then rotates clockwise `rotations` times, as a view of the same pixels.
+        """
+        self._set_pixels(np.rot90(self.pixels[::-1] if flipped else self.pixels, -rotations))
 
+    @timed('filter')
+    def apply_table(self, table):
+        """
+        Maps every pixel value p to table[p] in place, `table` is a uint8 array of 256 entries.
+        """
+        self.pixels[...] = table[self.pixels]
+        self._changed()
+
+    @timed('filter')
     def pixelate(self, pixelate_level=10):
-        n, m = len(self.data), len(self.data[0])
+        n, m = self.pixels.shape
         if pixelate_level <= 0 or pixelate_level >= min(n, m):
             raise RuntimeError(f"Invalid pixelation level!")
-        for i in range(0, n, pixelate_level):
-            for j in range(0, m, pixelate_level):
-                block = [self.data[x][y] for x in range(i, min(i + pixelate_level, n)) for y in range(j, min(j + pixelate_level, m))]
-                avg = sum(block) // len(block)
-                for x in range(i, min(i + pixelate_level, n)):
-                    for y in range(j, min(j + pixelate_level, m)):
-                        self.data[x][y] = avg
+        tiles = self._tiles()
+        if tiles == 1:
+            pixelate_rows(self.pixels, integral_image(self.pixels), pixelate_level)
+        else:
+            # bands start on block boundaries, so every block lies in one band and no halo is needed
+            def pixelate_band(r0, r1):
+                band = self.pixels[r0:r1]
+                pixelate_rows(band, integral_image(band), pixelate_level)
+            run_tiles(pixelate_band, row_bands(n, tiles, pixelate_level))
+        self._changed()
 
     def predict(self, chat_id, image_id):
-        print("predict() called with chat_id:", chat_id)
-
-        queue_url = os.getenv('QUEUE_URL')
-        aws_region = os.getenv('SQS_AWS_REGION')
-        sqs = boto3.client('sqs', region_name=aws_region)
-
-        message = {
-            "image_id": str(image_id),
-            "chat_id": str(chat_id)
-        }
-
-        try:
-            response = sqs.send_message(
-                QueueUrl=queue_url,
-                MessageBody=json.dumps(message)
-            )
-            print("✅ Message sent to SQS:", response['MessageId'])
-            return {"status": "queued", "message_id": response['MessageId']}
-        except Exception as e:
-            print("❌ Failed to send message to SQS:", e)
-            return {"status": "error", "error": str(e)}
+        return request_prediction(chat_id, image_id)
+
+
+def request_prediction(chat_id, image_id):
+    """
+    Queues a YOLO prediction for an image already uploaded to S3, no pixels are needed for that.
+    Requests from concurrent chats are sent to SQS in batches, see polybot.sqs_producer.
+    """
+    print("predict() called with chat_id:", chat_id)
+
+    try:
+        with stage('sqs_send'):
+            message_id = send_prediction_request(chat_id, image_id).result(timeout=30)
+        print("✅ Message sent to SQS:", message_id)
+        return {"status": "queued", "message_id": message_id}
+    except Exception as e:
+        print("❌ Failed to send message to SQS:", e)
+        return {"status": "error", "error": str(e)}
+
+
+def send_prediction_request(chat_id, image_id):
+    """
+    Queues a YOLO prediction without waiting for it: returns the Future of the SQS message id.
+    """
+    message = {
+        "image_id": str(image_id),
+        "chat_id": str(chat_id)
+    }
+    return get_producer(os.getenv('QUEUE_URL'), os.getenv('SQS_AWS_REGION'), 'predictions').send(message)
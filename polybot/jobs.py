@@ -0,0 +1,131 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from loguru import logger
+from polybot.pipeline import Step
+from polybot.workers import run_inline, run_pipeline
+from polybot.metrics import stage, timed
+
+
+def job_body(chat_id, message_id, photo, steps, max_dim=None):
+    """
+    The queue message of a filter job: everything a worker on another node needs to run it.
+    The job id is the chat and message ids, so enqueueing the same Telegram message twice gives the same job.
+    """
+    return {
+        'job_id': f'{chat_id}:{message_id}',
+        'chat_id': chat_id,
+        'file_id': photo['file_id'],
+        'steps': [[step.name, list(step.args)] for step in steps],
+        'max_dim': max_dim,
+    }
+
+
+def job_steps(body):
+    return [Step(name, tuple(args)) for name, args in body['steps']]
+
+
+def queueable(steps):
+    """
+    concat1/concat2 keep the first photo on the disk of the node that got it, so they can't go to the queue.
+    """
+    return not any(step.name in ('concat1', 'concat2') for step in steps)
+
+
+class MemoryLedger:
+    """
+    The ids of the jobs already replied to, the newest `max_jobs` of them. Only covers one worker,
+    enough when a single worker consumes the queue.
+    """
+
+    def __init__(self, max_jobs=10000):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, job_id):
+        with self._lock:
+            return job_id in self._jobs
+
+    def record(self, job_id):
+        with self._lock:
+            self._jobs[job_id] = True
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+
+
+class S3Ledger:
+    """
+    The ids of the jobs already replied to, as empty objects under `prefix` in an S3 bucket,
+    so it is shared by the workers of every node. An expiration lifecycle rule on the prefix cleans it up.
+    """
+
+    def __init__(self, s3, bucket, prefix='filter-replies/'):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def seen(self, job_id):
+        from botocore.exceptions import ClientError
+        try:
+            self.s3.head_object(Bucket=self.bucket, Key=f'{self.prefix}{job_id}')
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def record(self, job_id):
+        self.s3.put_object(Bucket=self.bucket, Key=f'{self.prefix}{job_id}', Body=b'')
+
+
+class FilterJobHandler:
+    """
+    Runs the filter jobs of the queue: downloads the photo from Telegram, runs the plan and sends the result.
+
+    Messages are delivered at least once (a worker dying mid job, a visibility timeout running out),
+    so the reply is recorded in `ledger` once sent and a job already replied to is acknowledged without
+    running it again. Filter errors and photos that can't be decoded (OSError, ValueError) are replied and
+    acknowledged too, they would fail the same way on retry; any other error (Telegram down, S3 unavailable)
+    raises so the message is redelivered. `give_up` is the reply for a job the consumer stops retrying.
+    """
+
+    # what a pipeline raises for a bad plan or a payload that isn't an image (PIL.UnidentifiedImageError is an OSError)
+    JOB_ERRORS = (RuntimeError, OSError, ValueError)
+
+    def __init__(self, bot, ledger, filter_pool=None):
+        self.bot = bot
+        self.ledger = ledger
+        self.filter_pool = filter_pool
+
+    @timed('handle_job')
+    def __call__(self, body):
+        job_id = body['job_id']
+        chat_id = body['chat_id']
+        if self.ledger.seen(job_id):
+            logger.info(f"Job {job_id} was already replied to, skipping")
+            return
+
+        with stage('download'):
+            file_info = self.bot.get_file(body['file_id'])
+            data = self.bot.download_file(file_info.file_path)
+        name = Path(file_info.file_path).name
+
+        args = (data, job_steps(body), name, body.get('max_dim'))
+        future = run_inline(run_pipeline, *args) if self.filter_pool is None else self.filter_pool.submit(run_pipeline, *args)
+        if future is None:
+            raise RuntimeError(f"Filter pool is full, job {job_id} will be redelivered")
+        try:
+            processed = future.result()
+        except self.JOB_ERRORS as e:
+            logger.warning(f"Job {job_id} failed: {e}")
+            self.bot.send_message(chat_id, f"Error: {str(e)}")
+        else:
+            with stage('send_photo'):
+                self.bot.send_photo(chat_id, processed)
+        self.ledger.record(job_id)
+
+    def give_up(self, body):
+        if not self.ledger.seen(body['job_id']):
+            self.bot.send_message(body['chat_id'], "Error processing image.")
+            self.ledger.record(body['job_id'])
@@ -0,0 +1,168 @@
+import os
+import time
+import socket
+from contextlib import contextmanager
+from functools import wraps
+from loguru import logger
+
+try:
+    from opentelemetry import metrics as otel_metrics
+except ImportError:
+    otel_metrics = None
+
+# seconds, from a cache hit to a slow 4096x4096 job
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_queues = {}
+# the service name given to setup_metrics, a forked child exports under it with its own provider
+_service = None
+
+
+class _NoopInstrument:
+    def record(self, *args, **kwargs):
+        pass
+
+    def add(self, *args, **kwargs):
+        pass
+
+
+def _observe_queues(options):
+    return [otel_metrics.Observation(depth(), {'queue': name}) for name, depth in list(_queues.items())]
+
+
+def _create_instruments(meter):
+    global STAGE_DURATION, IN_FLIGHT, CACHE_REQUESTS
+    STAGE_DURATION = meter.create_histogram(
+        'polybot.stage.duration', unit='s', explicit_bucket_boundaries_advisory=STAGE_BUCKETS,
+        description='Time spent in one stage of a request: download, decode, a filter, encode, send_photo, S3, SQS...')
+    IN_FLIGHT = meter.create_up_down_counter(
+        'polybot.jobs.in_flight', description='Jobs started and not finished yet, by kind')
+    CACHE_REQUESTS = meter.create_counter(
+        'polybot.cache.requests', description='Result cache lookups, by tier and result (hit or miss)')
+    meter.create_observable_gauge(
+        'polybot.queue.depth', callbacks=[_observe_queues], description='Jobs waiting in an in-process queue')
+
+
+if otel_metrics is not None:
+    _create_instruments(otel_metrics.get_meter('polybot'))
+else:
+    STAGE_DURATION = IN_FLIGHT = CACHE_REQUESTS = _NoopInstrument()
+
+
+def _exporting_provider(service_name):
+    """
+    A MeterProvider exporting over OTLP as this process: every process, filter workers included, is its own
+    service.instance.id, so their cumulative series don't overwrite each other in the collector.
+    """
+    from opentelemetry.sdk.metrics import MeterProvider
+    from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+
+    class ProcessMetricReader(PeriodicExportingMetricReader):
+        def _at_fork_reinit(self):
+            # the SDK restarts the export thread in a forked child, which would export the parent's series
+            # under the parent's identity. The child gets its own provider instead, see _after_fork
+            pass
+
+    resource = Resource.create({
+        'service.name': os.getenv('OTEL_SERVICE_NAME', service_name),
+        'service.instance.id': f'{socket.gethostname()}-{os.getpid()}',
+        'process.pid': os.getpid(),
+    })
+    return MeterProvider(resource=resource, metric_readers=[ProcessMetricReader(OTLPMetricExporter())])
+
+
+def _after_fork():
+    # the parent's queues are not in this process, and its instruments belong to the parent's provider
+    _queues.clear()
+    try:
+        _create_instruments(_exporting_provider(_service).get_meter('polybot'))
+    except Exception as e:
+        logger.warning(f'Metrics of process {os.getpid()} are not exported: {e}')
+        _create_instruments(otel_metrics.NoOpMeterProvider().get_meter('polybot'))
+
+
+def setup_metrics(service_name):
+    """
+    Exports the metrics over OTLP/HTTP to the collector, which serves them to Prometheus.
+    The standard OTEL_* variables apply: OTEL_EXPORTER_OTLP_ENDPOINT (default http://localhost:4318),
+    OTEL_METRIC_EXPORT_INTERVAL (ms), and OTEL_METRICS_EXPORTER=none turns the export off.
+    Processes forked afterwards (the filter workers) export their own metrics, as their own instance.
+    """
+    global _service
+    if os.getenv('OTEL_METRICS_EXPORTER', 'otlp') == 'none':
+        return
+    try:
+        provider = _exporting_provider(service_name)
+    except ImportError:
+        logger.warning('opentelemetry-sdk is not installed, metrics are not exported')
+        return
+
+    otel_metrics.set_meter_provider(provider)
+    if _service is None:
+        os.register_at_fork(after_in_child=_after_fork)
+    _service = service_name
+    logger.info(f'Exporting metrics of {service_name} over OTLP')
+
+
+@contextmanager
+def stage(name, **attributes):
+    """
+    Records how long the block took in the stage duration histogram, with outcome "error" if it raised.
+    """
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        record_stage(name, time.perf_counter() - start, outcome, **attributes)
+
+
+def record_stage(name, seconds, outcome='ok', **attributes):
+    """
+    Records a stage that was timed by hand, e.g. one that ends in a callback.
+    """
+    STAGE_DURATION.record(seconds, {'stage': name, 'outcome': outcome, **attributes})
+
+
+def timed(name, **attributes):
+    """
+    Decorator form of `stage`, the function name is recorded as the "step" attribute.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name, step=fn.__name__, **attributes):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def job_started(kind):
+    IN_FLIGHT.add(1, {'kind': kind})
+
+
+def job_finished(kind):
+    IN_FLIGHT.add(-1, {'kind': kind})
+
+
+@contextmanager
+def in_flight(kind):
+    job_started(kind)
+    try:
+        yield
+    finally:
+        job_finished(kind)
+
+
+def cache_lookup(hit, tier):
+    CACHE_REQUESTS.add(1, {'tier': tier, 'result': 'hit' if hit else 'miss'})
+
+
+def register_queue(name, depth):
+    """
+    Reports `depth()` as the depth of queue `name` whenever metrics are collected.
+    """
+    _queues[name] = depth
@@ -0,0 +1,177 @@
+from collections import namedtuple
+
+import numpy as np
+
+Step = namedtuple('Step', ['name', 'args'])
+
+GEOMETRIC_FILTERS = {'rotate', 'flip'}
+POINT_FILTERS = {'invert', 'segment', 'binary'}
+THRESHOLDS = {'segment': 100, 'binary': 127}
+
+
+class InvalidFilterError(RuntimeError):
+    def __init__(self, caption):
+        super().__init__(f"Invalid filter: {caption}")
+        self.caption = caption
+
+
+def parse_filter(caption):
+    parts = caption.split()
+    if caption == 'concat1':
+        return Step('concat1', ())
+    if caption.startswith('concat2'):
+        return Step('concat2', (parts[1] if len(parts) > 1 else 'horizontal',))
+    if caption.startswith('blur'):
+        return Step('blur', (int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 16,))
+    if caption in ('contour', 'rotate', 'segment', 'invert', 'binary'):
+        return Step(caption, ())
+    if caption == 'salt and pepper':
+        return Step('salt_n_pepper', ())
+    if caption.startswith('concat'):
+        return Step('concat', (parts[1] if len(parts) > 1 and parts[1] in ['horizontal', 'vertical'] else 'horizontal',))
+    if caption.startswith('flip'):
+        return Step('flip', (parts[1] if len(parts) > 1 else 'vertical',))
+    if caption.startswith('pixel'):
+        return Step('pixelate', (int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 10,))
+    raise InvalidFilterError(caption)
+
+
+def parse_caption(caption_raw):
+    """
+    Turns a comma separated caption such as "blur 5, rotate" into a list of steps.
+    Raises InvalidFilterError on the first caption that is not a known filter.
+    """
+    captions = [c.strip() for c in caption_raw.strip().lower().split(',') if c.strip()]
+    return [parse_filter(caption) for caption in captions]
+
+
+def _apply_geometric(pixels, step):
+    if step.name == 'rotate':
+        return pixels[::-1].T
+    if step.args[0] == 'vertical':
+        return pixels[:, ::-1]
+    if step.args[0] == 'horizontal':
+        return pixels[::-1]
+    return pixels
+
+
+def _transform(pixels, rotations, flipped):
+    return np.rot90(pixels[::-1] if flipped else pixels, -rotations)
+
+
+_PROBE = np.arange(6).reshape(2, 3)
+
+
+def fold_geometric(steps):
+    """
+    Reduces a run of rotate/flip steps to a single (rotations, flipped) transform:
+    flip the rows first if `flipped`, then rotate clockwise `rotations` times.
+    """
+    probe = _PROBE
+    for step in steps:
+        probe = _apply_geometric(probe, step)
+    for flipped in (False, True):
+        for rotations in range(4):
+            if np.array_equal(_transform(_PROBE, rotations, flipped), probe):
+                return rotations, flipped
+
+
+def _apply_point(name, values):
+    if name == 'invert':
+        return 255 - values
+    return np.where(values > THRESHOLDS[name], 255, 0).astype(np.uint8)
+
+
+_IDENTITY = np.arange(256, dtype=np.uint8)
+
+
+class PointChain:
+    """
+    A run of invert/segment/binary steps fused into a single pass.
+    Every step maps a pixel value to a pixel value, so the whole run is one 256 entry lookup table.
+    """
+
+    def __init__(self, names):
+        self.names = tuple(names)
+        self.table = _IDENTITY
+        for name in self.names:
+            self.table = _apply_point(name, self.table)
+
+    def is_identity(self):
+        return np.array_equal(self.table, _IDENTITY)
+
+    def apply(self, img):
+        img.apply_table(self.table)
+
+
+def optimize(steps):
+    """
+    Rewrites a parsed plan so it does as few passes over the pixels as possible.
+    Between two steps that mix neighbouring pixels (blur, contour, concat...), all invert/segment/binary
+    steps are fused into one PointChain and all rotate/flip steps are folded into one transform.
+    Point-wise steps commute with moving pixels around, so the two runs can be pulled apart.
+    """
+    optimized = []
+    points, geometric = [], []
+
+    def flush():
+        if points:
+            chain = PointChain(points)
+            if not chain.is_identity():
+                optimized.append(Step('point', (chain,)))
+        if geometric:
+            rotations, flipped = fold_geometric(geometric)
+            if rotations or flipped:
+                optimized.append(Step('transform', (rotations, flipped)))
+        points.clear()
+        geometric.clear()
+
+    for step in steps:
+        if step.name in POINT_FILTERS:
+            points.append(step.name)
+        elif step.name in GEOMETRIC_FILTERS:
+            geometric.append(step)
+        else:
+            flush()
+            optimized.append(step)
+    flush()
+    return optimized
+
+
+def plan_key(steps):
+    """
+    A stable text form of an optimized plan, e.g. "blur(5)|transform(1,False)", so that captions
+    with the same effect ("flip, flip, blur 5" and "Blur 5") share one key.
+    Returns None for plans whose result is not a pure function of the photo (random noise, concat with another photo).
+    """
+    parts = []
+    for step in optimize(steps):
+        if step.name in ('salt_n_pepper', 'concat1', 'concat2') or (step.name == 'concat' and len(step.args) > 1):
+            return None
+        args = step.args[0].names if step.name == 'point' else step.args
+        parts.append(f"{step.name}({','.join(str(a) for a in args)})")
+    return '|'.join(parts)
+
+
+class Pipeline:
+    def __init__(self, steps):
+        self.steps = optimize(steps)
+
+    @classmethod
+    def from_caption(cls, caption_raw):
+        return cls(parse_caption(caption_raw))
+
+    def run(self, img):
+        for step in self.steps:
+            if step.name == 'point':
+                step.args[0].apply(img)
+            elif step.name == 'transform':
+                img.transform(*step.args)
+            elif step.name == 'concat':
+                direction, *other = step.args
+                img.concat(other[0] if other else img, direction)
+            elif step.name in ('concat1', 'concat2'):
+                raise RuntimeError(f"{step.name} must be handled before running the pipeline.")
+            else:
+                getattr(img, step.name)(*step.args)
+        return img
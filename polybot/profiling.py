@@ -0,0 +1,210 @@
+import io
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from loguru import logger
+
+MODES = ('sample', 'cprofile')
+MAX_STACK_DEPTH = 64
+
+
+def _collapse(frame):
+    """
+    A stack in the collapsed "outer;...;inner" form that flame graph tools read.
+    """
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """
+    One background thread that samples the stacks of the threads it watches every `interval` seconds.
+    Watched threads run at full speed, so this is cheap enough to leave on for every request.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def watch(self, ident):
+        stacks = Counter()
+        with self._lock:
+            self._watched[ident] = stacks
+        return stacks
+
+    def unwatch(self, ident):
+        """
+        Stops sampling the thread and returns its stacks, which the sampler no longer writes to.
+        """
+        with self._lock:
+            return self._watched.pop(ident, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                idents = list(self._watched)
+            if not idents:
+                continue
+            frames = sys._current_frames()
+            samples = [(ident, _collapse(frames[ident])) for ident in idents if ident in frames]
+            # counted under the lock, so a thread unwatched meanwhile gets no more samples
+            with self._lock:
+                for ident, stack in samples:
+                    stacks = self._watched.get(ident)
+                    if stacks is not None:
+                        stacks[stack] += 1
+
+
+class SlowRequestProfiler:
+    """
+    Profiles every request and keeps the profile only when the request took longer than `threshold` seconds.
+    Kept profiles are JSON files in `directory`, tagged with what the request was about (chat, plan, image size),
+    and only the newest `keep` of them are left on disk.
+
+    mode "sample" records sampled stacks (low overhead), mode "cprofile" a full cProfile of the request.
+    """
+
+    def __init__(self, threshold, directory, keep=50, mode='sample', interval=0.005):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode!r}, expected one of {MODES}")
+        self.threshold = threshold
+        self.directory = Path(directory)
+        self.keep = keep
+        self.mode = mode
+        self.interval = interval
+        self._sampler = None
+        self._sampler_pid = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """
+        The profiler configured by SLOW_PROFILE_MS (the threshold, unset or 0 turns profiling off),
+        SLOW_PROFILE_DIR, SLOW_PROFILE_KEEP, SLOW_PROFILE_MODE and SLOW_PROFILE_INTERVAL_MS.
+        """
+        threshold_ms = int(os.getenv('SLOW_PROFILE_MS', 0))
+        if threshold_ms <= 0:
+            return None
+        return cls(threshold_ms / 1000,
+                   os.getenv('SLOW_PROFILE_DIR', 'profiles'),
+                   int(os.getenv('SLOW_PROFILE_KEEP', 50)),
+                   os.getenv('SLOW_PROFILE_MODE', 'sample'),
+                   int(os.getenv('SLOW_PROFILE_INTERVAL_MS', 5)) / 1000)
+
+    def sampler(self):
+        # threads do not survive a fork, each filter worker starts its own sampler
+        with self._lock:
+            if self._sampler is None or self._sampler_pid != os.getpid():
+                self._sampler = StackSampler(self.interval)
+                self._sampler_pid = os.getpid()
+            return self._sampler
+
+    @contextmanager
+    def profile(self, name, **tags):
+        """
+        Profiles the block. Yields the tags, so the block can add what it only learns on the way (e.g. image size).
+        A block nested in one that is already profiled on this thread is covered by the outer one.
+        """
+        if getattr(self._local, 'active', False):
+            yield tags
+            return
+
+        self._local.active = True
+        ident = threading.get_ident()
+        profile = stacks = None
+        if self.mode == 'cprofile':
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Python 3.12+ allows one active cProfile per process, concurrent requests fall back to sampling
+                profile = None
+        if profile is None:
+            self.sampler().watch(ident)
+        start = time.perf_counter()
+        try:
+            yield tags
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+            else:
+                stacks = self.sampler().unwatch(ident)
+            self._local.active = False
+            if elapsed >= self.threshold:
+                try:
+                    self.dump(name, elapsed, tags, profile, stacks)
+                except Exception as e:
+                    logger.warning(f"Could not store the profile of a slow {name}: {e}")
+
+    def dump(self, name, elapsed, tags, profile=None, stacks=None):
+        record = {
+            'name': name,
+            'seconds': round(elapsed, 4),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'pid': os.getpid(),
+            'mode': 'cprofile' if profile is not None else 'sample',
+            'tags': {key: str(value) for key, value in tags.items()},
+        }
+        if profile is not None:
+            text = io.StringIO()
+            pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(60)
+            record['stats'] = text.getvalue()
+        else:
+            record['interval'] = self.interval
+            record['stacks'] = dict(stacks.most_common())
+
+        path = self.directory / f'{time.time_ns()}-{os.getpid()}-{name}.json'
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(record, indent=1))
+        tmp_path.replace(path)
+        logger.warning(f"Slow {name} ({elapsed:.2f} s, {record['tags']}), profile stored in {path}")
+        self._trim()
+
+    def _trim(self):
+        dumps = sorted(self.directory.glob('*.json'))
+        for path in dumps[:max(0, len(dumps) - self.keep)]:
+            path.unlink(missing_ok=True)
+
+
+_profiler = SlowRequestProfiler.from_env()
+
+
+@contextmanager
+def profiled(name, **tags):
+    """
+    Profiles the block with the profiler configured from the environment, does nothing when profiling is off.
+    """
+    if _profiler is None:
+        yield tags
+        return
+    with _profiler.profile(name, **tags) as tags:
+        yield tags
+
+
+def message_tags(msg):
+    """
+    The tags of a Telegram message: chat, caption and the size of the largest photo it has.
+    """
+    tags = {'chat_id': msg.get('chat', {}).get('id'), 'caption': msg.get('caption', '')}
+    if msg.get('photo'):
+        photo = msg['photo'][-1]
+        tags['dims'] = f"{photo.get('width')}x{photo.get('height')}"
+    return tags
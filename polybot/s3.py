@@ -1,19 +1,168 @@
+import io
 import os
-import boto3
+import re
+import time
+import threading
+from urllib.parse import unquote_plus
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.exceptions import ClientError
+from s3transfer.subscribers import BaseSubscriber
 from dotenv import load_dotenv
+from polybot.aws import get_client
+from polybot.metrics import timed
 load_dotenv()
 
 
 AWS_REGION = os.environ["AWS_REGION"]
 AWS_S3_BUCKET = os.environ["AWS_S3_BUCKET"]
 
-s3 = boto3.client('s3', region_name=AWS_REGION)
+
+MB = 1024 * 1024
+
+_transfer_manager = None
+_transfer_lock = threading.Lock()
+
+
+def s3_client():
+    return get_client('s3', AWS_REGION)
+
+
+def transfer_config():
+    return TransferConfig(
+        multipart_threshold=int(os.getenv('S3_MULTIPART_THRESHOLD_MB', 8)) * MB,
+        multipart_chunksize=int(os.getenv('S3_MULTIPART_CHUNKSIZE_MB', 8)) * MB,
+        max_concurrency=int(os.getenv('S3_MAX_CONCURRENCY', 10)),
+    )
+
+
+def transfer_manager():
+    """
+    The process wide transfer manager: one thread pool for all uploads and downloads, so background
+    transfers are bounded by S3_MAX_CONCURRENCY instead of each call starting its own threads.
+    """
+    global _transfer_manager
+    with _transfer_lock:
+        if _transfer_manager is None:
+            _transfer_manager = create_transfer_manager(s3_client(), transfer_config())
+        return _transfer_manager
+
+
+def _forget_transfer_manager():
+    global _transfer_manager
+    _transfer_manager = None
+
+
+os.register_at_fork(after_in_child=_forget_transfer_manager)
+
+
+class _OnDone(BaseSubscriber):
+    def __init__(self, callback):
+        self._callback = callback
+
+    def on_done(self, future, **kwargs):
+        try:
+            future.result()
+            error = None
+        except Exception as e:
+            error = e
+        self._callback(error)
+
+
+PREDICTED_KEY_PATTERN = re.compile(r'^(?P<chat_id>[^/]+)/predicted/image_(?P<image_id>[^/.]+)\.[^/]+$')
+
+
+def predicted_image_key(chat_id, image_id):
+    return f"{chat_id}/predicted/image_{image_id}.jpg"
+
+
+def predicted_images_from_event(event: dict):
+    """
+    Yields (chat_id, image_id, s3_key) for every predicted image created in an S3 event notification.
+    Records of other events or without an object key are skipped.
+    """
+    for record in event.get('Records', []):
+        key = record.get('s3', {}).get('object', {}).get('key')
+        if not record.get('eventName', '').startswith('ObjectCreated') or not key:
+            continue
+        s3_key = unquote_plus(key)
+        match = PREDICTED_KEY_PATTERN.match(s3_key)
+        if match:
+            yield match['chat_id'], match['image_id'], s3_key
 
 
 def upload_image_to_s3(local_path, s3_key):
-    s3.upload_file(local_path, AWS_S3_BUCKET, s3_key)
+    transfer_manager().upload(local_path, AWS_S3_BUCKET, s3_key).result()
+
+
+@timed('s3_upload')
+def upload_image_bytes_to_s3(data: bytes, s3_key: str):
+    transfer_manager().upload(io.BytesIO(data), AWS_S3_BUCKET, s3_key).result()
+
+
+def upload_image_bytes_to_s3_in_background(data: bytes, s3_key: str, on_done=None):
+    """
+    Starts the upload and returns right away. `on_done(error)` is called from a transfer thread
+    when it finishes, with None on success.
+    """
+    subscribers = [_OnDone(on_done)] if on_done else None
+    return transfer_manager().upload(io.BytesIO(data), AWS_S3_BUCKET, s3_key, subscribers=subscribers)
 
 
 def download_predicted_image_from_s3(chat_id: str, image_id: str, local_path: str):
-    s3_key = f"{chat_id}/predicted/image_{image_id}.jpg"
-    s3.download_file(AWS_S3_BUCKET, s3_key, local_path)
+    transfer_manager().download(AWS_S3_BUCKET, predicted_image_key(chat_id, image_id), local_path).result()
+
+
+def read_predicted_image_from_s3(chat_id: str, image_id: str) -> bytes:
+    buffer = io.BytesIO()
+    transfer_manager().download(AWS_S3_BUCKET, predicted_image_key(chat_id, image_id), buffer).result()
+    return buffer.getvalue()
+
+
+def read_s3_object(s3_key: str) -> bytes:
+    return s3_client().get_object(Bucket=AWS_S3_BUCKET, Key=s3_key)['Body'].read()
+
+
+def read_s3_range(s3_key: str, start: int, end: int) -> bytes:
+    """
+    Bytes start..end (inclusive) of an object, e.g. just the header of a large image.
+    """
+    return s3_client().get_object(Bucket=AWS_S3_BUCKET, Key=s3_key, Range=f'bytes={start}-{end}')['Body'].read()
+
+
+def stream_s3_object(s3_key: str, chunk_size=256 * 1024):
+    """
+    Yields an object in chunks as they arrive, without holding all of it in memory.
+    """
+    body = s3_client().get_object(Bucket=AWS_S3_BUCKET, Key=s3_key)['Body']
+    try:
+        yield from body.iter_chunks(chunk_size)
+    finally:
+        body.close()
+
+
+def s3_object_exists(s3_key: str) -> bool:
+    try:
+        s3_client().head_object(Bucket=AWS_S3_BUCKET, Key=s3_key)
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
+
+def wait_for_predicted_image(chat_id: str, image_id: str, timeout=30, first_delay=0.5, max_delay=8) -> bool:
+    """
+    Polls for a predicted image with HEAD requests and exponential backoff, the fallback when no
+    S3 event or YOLO callback tells us it is ready. Returns False if it did not show up within `timeout` seconds.
+    """
+    s3_key = predicted_image_key(chat_id, image_id)
+    deadline = time.monotonic() + timeout
+    delay = first_delay
+    while True:
+        if s3_object_exists(s3_key):
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
@@ -0,0 +1,217 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, wait
+from loguru import logger
+from polybot.metrics import register_queue
+
+# estimated seconds of the jobs that are not filter plans (predictions, invalid captions)
+LIGHT_JOB_COST = 0.05
+# virtual finish times of idle chats are dropped once more chats than this are tracked
+MAX_TRACKED_CHATS = 1000
+
+
+class Rejected(Exception):
+    pass
+
+
+class RateLimited(Rejected):
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limited, retry in {retry_after:.1f} s")
+        self.retry_after = retry_after
+
+
+class ChatQueueFull(Rejected):
+    pass
+
+
+class SchedulerFull(Rejected):
+    pass
+
+
+class TokenBucket:
+    """
+    Holds up to `burst` tokens and gains `rate` tokens per second.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount=1):
+        """
+        Takes `amount` tokens and returns 0, or returns how many seconds to wait until they are available.
+        """
+        self._refill(time.monotonic())
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0
+        return (amount - self.tokens) / self.rate
+
+
+class ChatRateLimiter:
+    """
+    One token bucket per chat, every job takes one token. At most `max_chats` buckets are kept,
+    the least recently used one is dropped first (it is most likely full again anyway).
+    """
+
+    def __init__(self, rate, burst, max_chats=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_chats = max_chats
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, chat_id):
+        with self._lock:
+            bucket = self._buckets.pop(chat_id, None) or TokenBucket(self.rate, self.burst)
+            self._buckets[chat_id] = bucket
+            while len(self._buckets) > self.max_chats:
+                self._buckets.popitem(last=False)
+            return bucket.take()
+
+
+class FairScheduler:
+    """
+    Runs jobs on `workers` threads, fairly across chats: a chat sending many or expensive jobs only delays itself.
+
+    Jobs are ordered by start-time fair queuing: a job's virtual start is the later of the current virtual time
+    and the virtual finish of the previous job of the same chat, and its virtual finish adds its estimated cost.
+    The job with the earliest virtual start runs next, so every chat with work waiting gets the same share
+    of cost, like a round-robin weighted by the cost of each job.
+
+    A job that returns a Future (e.g. a filter pool submission) keeps its worker until the Future is done,
+    so `workers` bounds the jobs really running and the waiting ones queue here, in fair order.
+
+    Low priority jobs wait in a second lane, they only start when no normal job is waiting,
+    and at most `low_priority_workers` of them run at once, so heavy plans never take every worker.
+    """
+
+    def __init__(self, workers, limiter=None, max_queued=100, max_queued_per_chat=3, low_priority_workers=None):
+        self.workers = workers
+        self.limiter = limiter
+        self.max_queued = max_queued
+        self.max_queued_per_chat = max_queued_per_chat
+        self.low_priority_workers = low_priority_workers or max(1, workers // 4)
+        self._heap = []
+        self._low_heap = []
+        self._low_running = 0
+        self._finish = {}
+        self._queued = {}
+        self._vtime = 0.0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = [threading.Thread(target=self._run, name=f'scheduler-{i}', daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+        register_queue('scheduler', lambda: self.queued)
+
+    @classmethod
+    def from_env(cls, workers):
+        """
+        CHAT_RATE_PER_MIN and CHAT_BURST limit the jobs of one chat, CHAT_MAX_QUEUED how many of them may wait
+        and SCHEDULER_MAX_QUEUED how many jobs may wait in total.
+        """
+        limiter = ChatRateLimiter(int(os.getenv('CHAT_RATE_PER_MIN', 10)) / 60, int(os.getenv('CHAT_BURST', 5)))
+        return cls(workers, limiter, int(os.getenv('SCHEDULER_MAX_QUEUED', 100)), int(os.getenv('CHAT_MAX_QUEUED', 3)))
+
+    @property
+    def queued(self):
+        return len(self._heap) + len(self._low_heap)
+
+    def submit(self, chat_id, cost, fn, low_priority=False):
+        """
+        Queues `fn()` as a job of `chat_id`. Raises RateLimited, ChatQueueFull or SchedulerFull instead of queueing
+        when the chat or the scheduler is over its limits.
+        """
+        with self._cond:
+            if self.queued >= self.max_queued:
+                raise SchedulerFull()
+            if self._queued.get(chat_id, 0) >= self.max_queued_per_chat:
+                raise ChatQueueFull()
+            if self.limiter is not None:
+                retry_after = self.limiter.take(chat_id)
+                if retry_after:
+                    raise RateLimited(retry_after)
+
+            if len(self._finish) > MAX_TRACKED_CHATS:
+                self._finish = {c: f for c, f in self._finish.items() if f > self._vtime or c in self._queued}
+            start = max(self._vtime, self._finish.get(chat_id, 0.0))
+            self._finish[chat_id] = start + cost
+            self._queued[chat_id] = self._queued.get(chat_id, 0) + 1
+            heapq.heappush(self._low_heap if low_priority else self._heap, (start, next(self._seq), chat_id, fn))
+            self._cond.notify()
+
+    def _pick(self):
+        if self._heap:
+            return self._heap, False
+        if self._low_heap and self._low_running < self.low_priority_workers:
+            self._low_running += 1
+            return self._low_heap, True
+        return None, False
+
+    def _next(self):
+        with self._cond:
+            heap, low_priority = self._pick()
+            while heap is None:
+                self._cond.wait()
+                heap, low_priority = self._pick()
+            start, _, chat_id, fn = heapq.heappop(heap)
+            self._vtime = max(self._vtime, start)
+            self._queued[chat_id] -= 1
+            if not self._queued[chat_id]:
+                del self._queued[chat_id]
+                # a chat with nothing queued starts again from the current virtual time, it keeps no credit
+                if self._finish[chat_id] <= self._vtime:
+                    del self._finish[chat_id]
+            return fn, low_priority
+
+    def _run(self):
+        while True:
+            fn, low_priority = self._next()
+            try:
+                result = fn()
+                if isinstance(result, Future):
+                    # the job reports its own errors, here we only wait for it to finish
+                    wait([result])
+            except Exception as e:
+                logger.error(f"Scheduled job failed: {e}")
+            finally:
+                if low_priority:
+                    with self._cond:
+                        self._low_running -= 1
+                        self._cond.notify_all()
+
+    async def run_async(self, chat_id, cost, coro_fn, low_priority=False):
+        """
+        Awaits `coro_fn()` once the scheduler gives this job its turn, holding a worker until it finishes.
+        Raises Rejected like `submit`.
+        """
+        loop = asyncio.get_running_loop()
+        turn = loop.create_future()
+        done = Future()
+
+        def grant():
+            if not turn.done():
+                turn.set_result(None)
+
+        def start():
+            loop.call_soon_threadsafe(grant)
+            return done
+
+        self.submit(chat_id, cost, start, low_priority)
+        try:
+            await turn
+            return await coro_fn()
+        finally:
+            done.set_result(None)
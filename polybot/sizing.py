@@ -0,0 +1,75 @@
+import os
+import math
+from polybot.cost import estimate, scale_steps
+
+# the output may be this much smaller than the target, blur and contour trim a few pixels off the edges
+TARGET_SLACK = 0.95
+
+
+def long_side(photo):
+    return max(photo.get('width', 0), photo.get('height', 0))
+
+
+class PhotoSizePolicy:
+    """
+    Picks which of the sizes Telegram sends of a photo (e.g. 90, 320, 800 and 1280 px) to download:
+    the smallest one whose filtered result still has a long side of `target` px, or the largest one
+    when none does. Black and white results (binary, segment) only need `bw_target` px, and a pixelated
+    result only needs enough pixels for each block to stay `min_block` px wide.
+    Predictions use the smallest size that covers the YOLO input size, it resizes to that anyway.
+    """
+
+    def __init__(self, target=1280, bw_target=800, min_block=8, prediction_target=640):
+        self.target = target
+        self.bw_target = bw_target
+        self.min_block = min_block
+        self.prediction_target = prediction_target
+
+    @classmethod
+    def from_env(cls):
+        """
+        PHOTO_TARGET_DIMENSION, PHOTO_BW_TARGET_DIMENSION, PHOTO_MIN_PIXEL_BLOCK and YOLO_INPUT_DIMENSION.
+        """
+        return cls(int(os.getenv('PHOTO_TARGET_DIMENSION', 1280)),
+                   int(os.getenv('PHOTO_BW_TARGET_DIMENSION', 800)),
+                   int(os.getenv('PHOTO_MIN_PIXEL_BLOCK', 8)),
+                   int(os.getenv('YOLO_INPUT_DIMENSION', 640)))
+
+    def required_output(self, steps, source_long_side):
+        """
+        The long side the result of `steps` needs, `source_long_side` being the size the levels refer to.
+        """
+        target = self.target
+        if any(step.name in ('binary', 'segment') for step in steps):
+            target = min(target, self.bw_target)
+        for step in steps:
+            if step.name == 'pixelate':
+                target = min(target, math.ceil(source_long_side / step.args[0]) * self.min_block)
+        return target
+
+    def select(self, photos, steps):
+        """
+        Returns the photo size to download and the steps to run on it (levels scaled to that size).
+        """
+        largest = photos[-1]
+        # the two halves of a concat have to come from photos of the same size
+        if not long_side(largest) or any(step.name in ('concat1', 'concat2') for step in steps):
+            return largest, steps
+
+        largest_output = estimate(steps, largest['width'], largest['height'])
+        required = min(self.required_output(steps, long_side(largest)),
+                       max(largest_output.width, largest_output.height)) * TARGET_SLACK
+        for photo in sorted(photos[:-1], key=long_side):
+            if not long_side(photo):
+                continue
+            scaled = scale_steps(steps, long_side(photo) / long_side(largest))
+            output = estimate(scaled, photo['width'], photo['height'])
+            if max(output.width, output.height) >= required:
+                return photo, scaled
+        return largest, steps
+
+    def select_for_prediction(self, photos):
+        for photo in sorted(photos, key=long_side):
+            if long_side(photo) >= self.prediction_target:
+                return photo
+        return photos[-1]
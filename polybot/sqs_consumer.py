@@ -0,0 +1,164 @@
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from polybot.metrics import job_started, job_finished
+
+SQS_MAX_BATCH = 10
+
+
+class SQSConsumer:
+    """
+    Receives messages from an SQS queue and runs `handler(msg_body)` for each of them on a pool of worker threads.
+
+    - up to `workers` messages are in flight at once, receives ask for at most 10 (the SQS maximum) free slots
+    - while a message is being handled its visibility timeout is extended every `heartbeat_interval` seconds,
+      so a slow job is not redelivered to another consumer
+    - handled messages are deleted with delete_message_batch, failed ones are left to reappear after the timeout
+    - with `max_receives`, a message received more often than that is given up: `on_give_up(msg_body)` runs
+      instead of the handler and the message is deleted, so a poison message is not retried forever even
+      without a redrive policy on the queue
+    """
+
+    def __init__(self, sqs, queue_url, handler, workers=4, wait_time=20, visibility_timeout=60, heartbeat_interval=20,
+                 max_receives=None, on_give_up=None):
+        self.sqs = sqs
+        self.queue_url = queue_url
+        self.handler = handler
+        self.workers = workers
+        self.wait_time = wait_time
+        self.visibility_timeout = visibility_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.max_receives = max_receives
+        self.on_give_up = on_give_up
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='sqs-worker')
+        self._in_flight = {}
+        self._to_delete = []
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(workers)
+        self._stop = threading.Event()
+
+    @property
+    def in_flight(self):
+        with self._lock:
+            return len(self._in_flight)
+
+    def poll_once(self, wait_time=None):
+        """
+        Waits for at least one free worker, receives as many messages as there are free workers and dispatches them.
+        Returns the number of messages received.
+        """
+        self._slots.acquire()
+        free = 1
+        while free < SQS_MAX_BATCH and self._slots.acquire(blocking=False):
+            free += 1
+
+        messages = []
+        try:
+            response = self.sqs.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=free,
+                WaitTimeSeconds=self.wait_time if wait_time is None else wait_time,
+                VisibilityTimeout=self.visibility_timeout,
+                AttributeNames=['ApproximateReceiveCount'],
+            )
+            messages = response.get('Messages', [])
+        finally:
+            for _ in range(free - len(messages)):
+                self._slots.release()
+
+        for msg in messages:
+            with self._lock:
+                self._in_flight[msg['MessageId']] = msg['ReceiptHandle']
+            self._executor.submit(self._handle, msg)
+        return len(messages)
+
+    def _handle(self, msg):
+        job_started('sqs_message')
+        try:
+            receives = int(msg.get('Attributes', {}).get('ApproximateReceiveCount', 1))
+            if self.max_receives is not None and receives > self.max_receives:
+                logger.error(f"Giving up message {msg['MessageId']} after {receives - 1} failed attempts")
+                if self.on_give_up is not None:
+                    self.on_give_up(json.loads(msg['Body']))
+            else:
+                self.handler(json.loads(msg['Body']))
+        except Exception as e:
+            logger.error(f"Failed to handle message {msg['MessageId']}, it will be redelivered: {e}")
+            return
+        finally:
+            job_finished('sqs_message')
+            with self._lock:
+                self._in_flight.pop(msg['MessageId'], None)
+            self._slots.release()
+
+        with self._lock:
+            self._to_delete.append(msg)
+            full = len(self._to_delete) >= SQS_MAX_BATCH
+        if full:
+            try:
+                self.flush_deletes()
+            except Exception as e:
+                logger.warning(f"Failed to delete messages: {e}")
+
+    def flush_deletes(self):
+        with self._lock:
+            pending, self._to_delete = self._to_delete, []
+        for i in range(0, len(pending), SQS_MAX_BATCH):
+            batch = pending[i:i + SQS_MAX_BATCH]
+            try:
+                response = self.sqs.delete_message_batch(
+                    QueueUrl=self.queue_url,
+                    Entries=[{'Id': str(n), 'ReceiptHandle': msg['ReceiptHandle']} for n, msg in enumerate(batch)]
+                )
+            except Exception:
+                with self._lock:
+                    self._to_delete.extend(pending[i:])
+                raise
+            for failed in response.get('Failed', []):
+                logger.warning(f"Could not delete message {batch[int(failed['Id'])]['MessageId']}: {failed.get('Message')}")
+            logger.info(f"Deleted {len(batch) - len(response.get('Failed', []))} messages")
+
+    def extend_visibility(self):
+        with self._lock:
+            receipts = list(self._in_flight.items())
+        for i in range(0, len(receipts), SQS_MAX_BATCH):
+            batch = receipts[i:i + SQS_MAX_BATCH]
+            self.sqs.change_message_visibility_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{'Id': str(n), 'ReceiptHandle': receipt, 'VisibilityTimeout': self.visibility_timeout}
+                         for n, (_, receipt) in enumerate(batch)]
+            )
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                self.extend_visibility()
+                self.flush_deletes()
+            except Exception as e:
+                logger.warning(f"SQS heartbeat failed: {e}")
+
+    def run(self):
+        heartbeat = threading.Thread(target=self._heartbeat, name='sqs-heartbeat', daemon=True)
+        heartbeat.start()
+        try:
+            while not self._stop.is_set():
+                try:
+                    received = self.poll_once()
+                except Exception as e:
+                    logger.error(f"Failed to receive messages: {e}")
+                    received = 0
+                self.flush_deletes()
+                if not received:
+                    time.sleep(1)
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        self._stop.set()
+
+    def shutdown(self):
+        self._stop.set()
+        self._executor.shutdown(wait=True)
+        self.flush_deletes()
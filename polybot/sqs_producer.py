@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from loguru import logger
+from polybot.aws import get_client
+from polybot.metrics import register_queue
+
+SQS_MAX_BATCH = 10
+
+
+class SendError(Exception):
+    pass
+
+
+class BatchingProducer:
+    """
+    Collects messages for up to `linger` seconds (or until 10 are waiting) and sends them with one
+    send_message_batch call. `send` returns a Future resolved with the MessageId of that message,
+    or failed with SendError when SQS rejected that entry.
+    """
+
+    def __init__(self, sqs, queue_url, linger=0.01, max_batch=SQS_MAX_BATCH):
+        self.sqs = sqs
+        self.queue_url = queue_url
+        self.linger = linger
+        self.max_batch = min(max_batch, SQS_MAX_BATCH)
+        self._pending = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='sqs-producer', daemon=True)
+        self._thread.start()
+
+    def send(self, body):
+        future = Future()
+        self._pending.put((json.dumps(body) if not isinstance(body, str) else body, future))
+        return future
+
+    def _collect(self):
+        batch = [self._pending.get()]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self._send_batch(batch)
+
+    def _send_batch(self, batch):
+        try:
+            response = self.sqs.send_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{'Id': str(i), 'MessageBody': body} for i, (body, _) in enumerate(batch)]
+            )
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for entry in response.get('Successful', []):
+            batch[int(entry['Id'])][1].set_result(entry['MessageId'])
+        for entry in response.get('Failed', []):
+            batch[int(entry['Id'])][1].set_exception(SendError(f"{entry.get('Code')}: {entry.get('Message')}"))
+        logger.info(f"Sent {len(response.get('Successful', []))}/{len(batch)} messages in one batch")
+
+
+_producers = {}
+_lock = threading.Lock()
+
+
+def get_producer(queue_url, region_name=None, name=None):
+    """
+    The process wide producer for `queue_url`, started on first use. Its backlog is reported as queue
+    `sqs_producer:<name>`, the queue's name by default.
+    PREDICTION_BATCH_LINGER_MS sets how long a message may wait for others (default 10 ms).
+    """
+    with _lock:
+        producer = _producers.get(queue_url)
+        if producer is None:
+            linger = int(os.getenv('PREDICTION_BATCH_LINGER_MS', 10)) / 1000
+            producer = BatchingProducer(get_client('sqs', region_name), queue_url, linger)
+            _producers[queue_url] = producer
+            register_queue(f"sqs_producer:{name or queue_url.rstrip('/').rsplit('/', 1)[-1]}", producer._pending.qsize)
+        return producer
+
+
+# the sender thread does not survive a fork
+os.register_at_fork(after_in_child=_producers.clear)
@@ -0,0 +1,87 @@
+import time
+import uuid
+import threading
+
+
+class FakeSQS:
+    """
+    An in-memory stand-in for the boto3 SQS client, with visibility timeouts and receipt handles.
+    Only the calls the consumers use are implemented.
+    """
+
+    def __init__(self):
+        self.messages = {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _record(self, name):
+        self.calls.append(name)
+
+    def _enqueue(self, body):
+        message_id = str(uuid.uuid4())
+        with self._lock:
+            self.messages[message_id] = {'Body': body, 'visible_at': 0, 'receipt': None, 'receives': 0}
+        return message_id
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        self._record('send_message')
+        return {'MessageId': self._enqueue(MessageBody)}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self._record('send_message_batch')
+        assert len(Entries) <= 10
+        successful = [{'Id': entry['Id'], 'MessageId': self._enqueue(entry['MessageBody'])} for entry in Entries]
+        return {'Successful': successful, 'Failed': []}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0, VisibilityTimeout=30, AttributeNames=(),
+                        **kwargs):
+        self._record('receive_message')
+        assert 1 <= MaxNumberOfMessages <= 10
+        deadline = time.time() + WaitTimeSeconds
+        while True:
+            now = time.time()
+            with self._lock:
+                received = []
+                for message_id, message in self.messages.items():
+                    if len(received) == MaxNumberOfMessages:
+                        break
+                    if message['visible_at'] <= now:
+                        message['visible_at'] = now + VisibilityTimeout
+                        message['receipt'] = str(uuid.uuid4())
+                        message['receives'] += 1
+                        received.append({'MessageId': message_id, 'ReceiptHandle': message['receipt'], 'Body': message['Body']})
+                        if 'ApproximateReceiveCount' in AttributeNames:
+                            received[-1]['Attributes'] = {'ApproximateReceiveCount': str(message['receives'])}
+            if received or time.time() >= deadline:
+                return {'Messages': received} if received else {}
+            time.sleep(0.01)
+
+    def _find(self, receipt):
+        for message_id, message in self.messages.items():
+            if message['receipt'] == receipt:
+                return message_id
+        return None
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        self._record('delete_message_batch')
+        assert len(Entries) <= 10
+        successful, failed = [], []
+        with self._lock:
+            for entry in Entries:
+                message_id = self._find(entry['ReceiptHandle'])
+                if message_id is None:
+                    failed.append({'Id': entry['Id'], 'Message': 'ReceiptHandleIsInvalid'})
+                else:
+                    del self.messages[message_id]
+                    successful.append({'Id': entry['Id']})
+        return {'Successful': successful, 'Failed': failed}
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        self._record('change_message_visibility_batch')
+        assert len(Entries) <= 10
+        with self._lock:
+            for entry in Entries:
+                message_id = self._find(entry['ReceiptHandle'])
+                if message_id is not None:
+                    self.messages[message_id]['visible_at'] = time.time() + entry['VisibilityTimeout']
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries], 'Failed': []}
@@ -0,0 +1,80 @@
+import unittest
+import random
+import numpy as np
+from polybot.img_proc import Img
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+def naive_blur(data, level):
+    n, m = len(data), len(data[0])
+    return [[sum(sum(row[j:j + level]) for row in data[i:i + level]) // level ** 2
+             for j in range(m - level + 1)]
+            for i in range(n - level + 1)]
+
+
+def naive_pixelate(data, level):
+    n, m = len(data), len(data[0])
+    result = [row[:] for row in data]
+    for i in range(0, n, level):
+        for j in range(0, m, level):
+            block = [data[x][y] for x in range(i, min(i + level, n)) for y in range(j, min(j + level, m))]
+            avg = sum(block) // len(block)
+            for x in range(i, min(i + level, n)):
+                for y in range(j, min(j + level, m)):
+                    result[x][y] = avg
+    return result
+
+
+class TestImgBlur(unittest.TestCase):
+
+    def setUp(self):
+        self.img = Img(img_path)
+        self.small = [[float(random.randint(0, 255)) for _ in range(37)] for _ in range(29)]
+
+    def test_blur_dimension(self):
+        original_dimension = (len(self.img.data), len(self.img.data[0]))
+        self.img.blur(16)
+        actual_dimension = (len(self.img.data), len(self.img.data[0]))
+        self.assertEqual((original_dimension[0] - 15, original_dimension[1] - 15), actual_dimension)
+
+    def test_blur_matches_naive(self):
+        for level in (1, 2, 5, 16):
+            self.img.data = self.small
+            self.img.blur(level)
+            self.assertEqual(naive_blur(self.small, level), self.img.data)
+
+    def test_pixelate_matches_naive(self):
+        for level in (2, 7, 10):
+            self.img.data = self.small
+            self.img.pixelate(level)
+            self.assertEqual(naive_pixelate(self.small, level), self.img.data)
+
+    def test_blur_after_rotate_and_flip(self):
+        self.img.data = self.small
+        self.img.rotate()
+        self.img.flip('horizontal')
+        self.img.blur(3)
+        transformed = [list(row) for row in zip(*self.small[::-1])][::-1]
+        self.assertEqual(naive_blur(transformed, 3), self.img.data)
+        self.assertEqual(1, self.img.pixels.itemsize)
+
+    def test_invalid_level(self):
+        with self.assertRaises(RuntimeError):
+            self.img.blur(0)
+        with self.assertRaises(RuntimeError):
+            self.img.pixelate(len(self.img.data))
+
+    def test_summed_area_table_not_kept(self):
+        # the table is 4 to 8 bytes per pixel, it must not outlive the filter
+        img = Img(img_path)
+        img.blur(5)
+        img.pixelate(4)
+        kept = [value for value in vars(img).values()
+                if isinstance(value, np.ndarray) and value.dtype in (np.uint32, np.uint64)]
+        self.assertEqual([], kept)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import tempfile
+from pathlib import Path
+from unittest import mock
+from polybot.cache import ResultCache
+from polybot.pipeline import parse_caption, plan_key
+
+
+class TestResultCache(unittest.TestCase):
+
+    def test_plan_key_normalized(self):
+        self.assertEqual(plan_key(parse_caption('Blur 5')), plan_key(parse_caption('blur 5, flip, invert, flip, invert')))
+        self.assertNotEqual(plan_key(parse_caption('blur 5')), plan_key(parse_caption('blur 6')))
+
+    def test_random_plans_not_cached(self):
+        self.assertIsNone(plan_key(parse_caption('blur, salt and pepper')))
+        self.assertIsNone(plan_key(parse_caption('concat2')))
+        self.assertIsNone(ResultCache.make_key('unique', None))
+
+    def test_lru_eviction(self):
+        cache = ResultCache(max_bytes=10)
+        cache.put('a', b'12345')
+        cache.put('b', b'12345')
+        cache.get('a')
+        cache.put('c', b'12345')
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(b'12345', cache.get('c').data)
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as disk_dir:
+            cache = ResultCache(max_bytes=10, disk_dir=disk_dir, disk_max_bytes=10)
+            cache.put('a', b'12345', 'file-a')
+            cache.put('b', b'12345')
+
+            restarted = ResultCache(max_bytes=10, disk_dir=disk_dir, disk_max_bytes=10)
+            self.assertEqual(('12345'.encode(), 'file-a'), tuple(restarted.get('a')))
+
+            restarted.put('c', b'123456')
+            self.assertIsNone(ResultCache(disk_dir=disk_dir).get('b'))
+
+    def test_disk_writes_do_not_list_directory(self):
+        with tempfile.TemporaryDirectory() as disk_dir:
+            cache = ResultCache(max_bytes=10, disk_dir=disk_dir, disk_max_bytes=10)
+            cache.put('a', b'12345')
+            cache.put('b', b'12345')
+            with mock.patch.object(Path, 'iterdir', side_effect=AssertionError('directory listed')):
+                cache.put('c', b'12345')
+            self.assertIsNone(ResultCache(disk_dir=disk_dir).get('a'))
+            self.assertIsNotNone(ResultCache(disk_dir=disk_dir).get('b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import io
+import os
+import tempfile
+from pathlib import Path
+import numpy as np
+from unittest.mock import patch
+from PIL import Image, JpegImagePlugin
+from polybot.codec import encode_gray, load_gray, save_options
+from polybot.img_proc import Img
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+class TestCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.pixels = Img(img_path).pixels
+
+    def test_png_lossless_single_channel(self):
+        encoded = encode_gray(self.pixels, 'png')
+        self.assertEqual('L', Image.open(io.BytesIO(encoded)).mode)
+        np.testing.assert_array_equal(self.pixels, load_gray(io.BytesIO(encoded)))
+
+    def test_jpeg_single_channel(self):
+        encoded = encode_gray(self.pixels, 'jpg')
+        self.assertEqual('L', Image.open(io.BytesIO(encoded)).mode)
+        self.assertLess(np.abs(load_gray(io.BytesIO(encoded)).astype(int) - self.pixels).mean(), 3)
+
+    def test_strided_view_encoded(self):
+        np.testing.assert_array_equal(self.pixels[::-1].T, load_gray(io.BytesIO(encode_gray(self.pixels[::-1].T, 'png'))))
+
+    def test_large_jpeg_decoded_to_max_dim(self):
+        # a smooth RGB gradient, 4000x3000, so the downscaled result can be checked against the full decode
+        y, x = np.mgrid[0:3000, 0:4000]
+        rgb = np.stack([x * 255 // 3999, y * 255 // 2999, (x + y) * 255 // 6998], axis=-1).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(rgb).save(buffer, 'JPEG', quality=90)
+
+        buffer.seek(0)
+        full = load_gray(buffer)
+        buffer.seek(0)
+        draft = JpegImagePlugin.JpegImageFile.draft
+        with patch.object(JpegImagePlugin.JpegImageFile, 'draft', autospec=True, side_effect=draft) as spy:
+            small = load_gray(buffer, max_dim=1000)
+        # decoded at 1/2 scale, 2000x1500, then resized
+        self.assertEqual(('L', (1000, 1000)), spy.call_args[0][1:])
+
+        self.assertEqual((3000, 4000), full.shape)
+        self.assertEqual((750, 1000), small.shape)
+        self.assertEqual(np.uint8, small.dtype)
+        self.assertLessEqual(int(small.min()), int(full.min()) + 2)
+        self.assertGreaterEqual(int(small.max()), int(full.max()) - 2)
+        self.assertLess(abs(small.mean() - full.mean()), 2)
+        # the corners keep their gray level
+        self.assertLess(abs(int(small[-1, -1]) - int(full[-1, -1])), 4)
+
+    def test_format_options(self):
+        self.assertEqual('JPEG', save_options('jpg')[0])
+        self.assertIn('quality', save_options('jpeg')[1])
+        self.assertIn('compress_level', save_options('png')[1])
+
+    def test_save_img(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'photo.png'
+            img = Img.from_pixels(self.pixels, str(path))
+            saved = img.save_img()
+            self.assertEqual(path.with_name('photo_filtered.png'), saved)
+            self.assertEqual('L', Image.open(saved).mode)
+
+
+if __name__ == '__main__':
+    unittest.main()
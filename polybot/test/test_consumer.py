@@ -0,0 +1,80 @@
+import unittest
+import json
+import time
+import threading
+from polybot.sqs_consumer import SQSConsumer
+from polybot.test.fake_sqs import FakeSQS
+
+QUEUE_URL = 'http://localhost/queue/polybot'
+
+
+class TestSQSConsumer(unittest.TestCase):
+
+    def setUp(self):
+        self.sqs = FakeSQS()
+        self.handled = []
+        self.lock = threading.Lock()
+
+    def send(self, n):
+        for i in range(n):
+            self.sqs.send_message(QueueUrl=QUEUE_URL, MessageBody=json.dumps({'chat_id': i}))
+
+    def slow_handler(self, body):
+        time.sleep(0.2)
+        with self.lock:
+            self.handled.append(body['chat_id'])
+
+    def test_messages_handled_concurrently(self):
+        self.send(10)
+        consumer = SQSConsumer(self.sqs, QUEUE_URL, self.slow_handler, workers=10, wait_time=0)
+
+        start = time.time()
+        self.assertEqual(10, consumer.poll_once())
+        consumer.shutdown()
+
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(list(range(10)), sorted(self.handled))
+        self.assertEqual({}, self.sqs.messages)
+        self.assertEqual(1, self.sqs.calls.count('delete_message_batch'))
+
+    def test_receive_limited_by_free_workers(self):
+        self.send(5)
+        consumer = SQSConsumer(self.sqs, QUEUE_URL, self.slow_handler, workers=2, wait_time=0)
+
+        self.assertEqual(2, consumer.poll_once())
+        self.assertEqual(2, consumer.in_flight)
+        consumer.shutdown()
+
+    def test_failed_message_not_deleted(self):
+        self.send(1)
+
+        def failing_handler(body):
+            raise ValueError('boom')
+
+        consumer = SQSConsumer(self.sqs, QUEUE_URL, failing_handler, workers=1, wait_time=0)
+        consumer.poll_once()
+        consumer.shutdown()
+
+        self.assertEqual(1, len(self.sqs.messages))
+        self.assertNotIn('delete_message_batch', self.sqs.calls)
+
+    def test_visibility_extended_for_long_jobs(self):
+        self.send(1)
+        release = threading.Event()
+        consumer = SQSConsumer(self.sqs, QUEUE_URL, lambda body: release.wait(), workers=1, wait_time=0,
+                               visibility_timeout=1, heartbeat_interval=0.3)
+        runner = threading.Thread(target=consumer.run)
+        runner.start()
+
+        time.sleep(1.5)
+        self.assertIn('change_message_visibility_batch', self.sqs.calls)
+        self.assertEqual(1, list(self.sqs.messages.values())[0]['receives'])
+
+        release.set()
+        consumer.stop()
+        runner.join()
+        self.assertEqual({}, self.sqs.messages)
+
+
+if __name__ == '__main__':
+    unittest.main()
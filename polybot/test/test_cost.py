@@ -0,0 +1,68 @@
+import unittest
+from polybot.pipeline import parse_caption
+from polybot.cost import (estimate, fit, AdmissionPolicy, ACCEPT, LOW_PRIORITY, DOWNSCALE, REJECT)
+
+
+def photo_message(caption, width, height):
+    return {'caption': caption, 'photo': [{'width': width // 4, 'height': height // 4}, {'width': width, 'height': height}]}
+
+
+class TestCostModel(unittest.TestCase):
+
+    def test_output_size_follows_plan(self):
+        cost = estimate(parse_caption('blur 5, rotate, contour, concat vertical'), 400, 300)
+        self.assertEqual((295, 792), (cost.width, cost.height))
+
+    def test_concat_chain_grows_cost(self):
+        one = estimate(parse_caption('concat'), 1000, 1000)
+        three = estimate(parse_caption('concat, concat, concat'), 1000, 1000)
+        self.assertEqual(8000, three.width)
+        self.assertGreater(three.peak_bytes, 3 * one.peak_bytes)
+        self.assertGreater(three.seconds, 2 * one.seconds)
+
+    def test_small_pixelate_levels_cost_more(self):
+        self.assertGreater(estimate(parse_caption('pixel 2'), 2000, 2000).seconds,
+                           estimate(parse_caption('pixel 20'), 2000, 2000).seconds)
+
+    def test_fit(self):
+        self.assertEqual((1000, 500), fit(4000, 2000, 1000))
+        self.assertEqual((400, 300), fit(400, 300, 1000))
+
+
+class TestAdmissionPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = AdmissionPolicy(max_seconds=1, max_bytes=256 * 1024 * 1024, low_priority_seconds=0.2,
+                                      min_dim=256, max_dim=None)
+
+    def test_light_plan_accepted(self):
+        self.assertEqual(ACCEPT, self.policy.decide_message(photo_message('blur 5', 640, 480)).action)
+
+    def test_slow_plan_goes_to_low_priority(self):
+        decision = self.policy.decide_message(photo_message('blur, pixel, salt and pepper', 2560, 1920))
+        self.assertEqual(LOW_PRIORITY, decision.action)
+        self.assertIsNone(decision.max_dim)
+
+    def test_heavy_plan_downscaled_until_it_fits(self):
+        decision = self.policy.decide_message(photo_message('concat, concat, concat', 4000, 3000))
+        self.assertIn(decision.action, (DOWNSCALE, LOW_PRIORITY))
+        self.assertLess(decision.max_dim, 4000)
+        self.assertTrue(self.policy.fits(decision.cost))
+
+    def test_two_photo_concat_not_downscaled(self):
+        # the second photo would be decoded smaller than the stored first one
+        for caption in ('concat, concat, concat, concat1', 'concat2, concat, concat, concat'):
+            self.assertEqual(REJECT, self.policy.decide_message(photo_message(caption, 4000, 3000)).action)
+        self.assertIsNone(self.policy.decide_message(photo_message('concat2', 1280, 960)).max_dim)
+
+    def test_hopeless_plan_rejected(self):
+        plan = ', '.join(['concat'] * 12)
+        self.assertEqual(REJECT, self.policy.decide_message(photo_message(plan, 1280, 960)).action)
+
+    def test_not_a_filter_job(self):
+        self.assertIsNone(self.policy.decide_message(photo_message('predict', 1280, 960)))
+        self.assertIsNone(self.policy.decide_message(photo_message('sharpen', 1280, 960)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+from botocore.exceptions import ClientError
+from polybot.dedup import DedupIndex, DynamoDBClaims, update_keys
+
+
+def update(update_id, message_id=1, chat_id=5):
+    return {'update_id': update_id, 'message': {'message_id': message_id, 'chat': {'id': chat_id}}}
+
+
+class FakeDynamoDB:
+    """
+    put_item with the conditional check DynamoDBClaims uses, on a dict.
+    """
+
+    def __init__(self):
+        self.items = {}
+
+    def put_item(self, TableName, Item, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+        key = Item['key']['S']
+        held = self.items.get(key)
+        if held is not None and int(held['expires_at']['N']) >= int(ExpressionAttributeValues[':now']['N']):
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+        self.items[key] = Item
+
+    def delete_item(self, TableName, Key):
+        self.items.pop(Key['key']['S'], None)
+
+
+class TestDedupIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.index = DedupIndex(ttl=60, max_entries=100, clock=lambda: self.now)
+
+    def test_redelivered_update_is_duplicate(self):
+        self.assertTrue(self.index.first_seen(update(1)))
+        self.assertFalse(self.index.first_seen(update(1)))
+        self.assertTrue(self.index.first_seen(update(2, message_id=2)))
+
+    def test_same_message_in_another_update_is_duplicate(self):
+        self.index.first_seen(update(1))
+        self.assertFalse(self.index.first_seen(update(2)))
+        self.assertTrue(self.index.first_seen(update(3, chat_id=6)))
+
+    def test_entries_expire(self):
+        self.index.first_seen(update(1))
+        self.now = 61
+        self.assertTrue(self.index.first_seen(update(1)))
+
+    def test_bounded(self):
+        index = DedupIndex(max_entries=4)
+        for i in range(10):
+            index.first_seen(update(i, message_id=i))
+        self.assertEqual(4, len(index._expiry))
+        self.assertTrue(index.first_seen(update(0, message_id=0)))
+
+    def test_update_without_message(self):
+        self.assertEqual(['update:7'], update_keys({'update_id': 7, 'edited_message': {}}))
+        self.assertTrue(self.index.first_seen({}))
+        self.assertTrue(self.index.first_seen({}))
+
+    def test_shared_claims_across_replicas(self):
+        claims = DynamoDBClaims(FakeDynamoDB(), 'polybot-updates')
+        first, second = DedupIndex(claims=claims), DedupIndex(claims=claims)
+        self.assertTrue(first.first_seen(update(1)))
+        self.assertFalse(second.first_seen(update(1)))
+
+    def test_released_update_is_taken_again(self):
+        self.index.first_seen(update(1))
+        self.index.release(update(1))
+        self.assertTrue(self.index.first_seen(update(1)))
+
+    def test_release_frees_shared_claims(self):
+        dynamodb = FakeDynamoDB()
+        first, second = DedupIndex(claims=DynamoDBClaims(dynamodb, 't')), DedupIndex(claims=DynamoDBClaims(dynamodb, 't'))
+        first.first_seen(update(1))
+        first.release(update(1))
+        self.assertEqual({}, dynamodb.items)
+        self.assertTrue(second.first_seen(update(1)))
+
+    def test_failing_store_takes_update(self):
+        class Broken:
+            def claim(self, key, ttl):
+                raise ConnectionError('unreachable')
+        self.assertTrue(DedupIndex(claims=Broken()).first_seen(update(1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
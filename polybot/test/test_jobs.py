@@ -0,0 +1,108 @@
+import unittest
+import json
+from pathlib import Path
+from unittest.mock import MagicMock
+from polybot.bot import ImageProcessingBot
+from polybot.jobs import FilterJobHandler, MemoryLedger
+from polybot.sqs_consumer import SQSConsumer
+from polybot.sqs_producer import BatchingProducer
+from polybot.sizing import PhotoSizePolicy
+from polybot.test.fake_sqs import FakeSQS
+
+QUEUE_URL = 'http://localhost/queue/filter-jobs'
+IMAGE = Path(__file__).parent / 'beatles.jpeg'
+
+
+def telegram_client():
+    client = MagicMock()
+    client.get_file.return_value = MagicMock(file_path='photos/file_1.jpg')
+    client.download_file.return_value = IMAGE.read_bytes()
+    return client
+
+
+def photo_message(caption, message_id=7):
+    return {'chat': {'id': 42}, 'message_id': message_id, 'caption': caption,
+            'photo': [{'file_id': 'small', 'width': 90, 'height': 67}, {'file_id': 'large', 'width': 660, 'height': 495}]}
+
+
+class TestFilterJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.sqs = FakeSQS()
+        self.webhook_client = telegram_client()
+        self.processor = ImageProcessingBot(self.webhook_client, sizing=PhotoSizePolicy(),
+                                            job_queue=BatchingProducer(self.sqs, QUEUE_URL, linger=0))
+        self.worker_client = telegram_client()
+        self.ledger = MemoryLedger()
+
+    def run_worker(self, handler=None, **kwargs):
+        consumer = SQSConsumer(self.sqs, QUEUE_URL, handler or FilterJobHandler(self.worker_client, self.ledger),
+                               workers=1, wait_time=0, **kwargs)
+        consumer.poll_once()
+        consumer.shutdown()
+
+    def test_webhook_only_enqueues(self):
+        self.processor.handle_image(photo_message('blur 5, contour')).result(1)
+
+        self.webhook_client.get_file.assert_not_called()
+        body = json.loads(list(self.sqs.messages.values())[0]['Body'])
+        self.assertEqual({'job_id': '42:7', 'chat_id': 42, 'file_id': 'large', 'steps': [['blur', [5]], ['contour', []]],
+                          'max_dim': None}, body)
+
+    def test_worker_replies_and_acknowledges(self):
+        self.processor.handle_image(photo_message('blur 5, contour')).result(1)
+        self.run_worker()
+
+        self.worker_client.get_file.assert_called_once_with('large')
+        self.worker_client.send_photo.assert_called_once()
+        self.assertEqual({}, self.sqs.messages)
+
+    def test_redelivered_job_replied_once(self):
+        self.processor.handle_image(photo_message('invert')).result(1)
+        body = json.loads(list(self.sqs.messages.values())[0]['Body'])
+        handler = FilterJobHandler(self.worker_client, self.ledger)
+        handler(body)
+        handler(body)
+        self.worker_client.send_photo.assert_called_once()
+
+    def test_failed_reply_redelivered(self):
+        self.processor.handle_image(photo_message('invert')).result(1)
+        self.worker_client.send_photo.side_effect = ConnectionError('telegram down')
+        self.run_worker()
+        self.assertEqual(1, len(self.sqs.messages))
+
+        self.worker_client.send_photo.side_effect = None
+        list(self.sqs.messages.values())[0]['visible_at'] = 0
+        self.run_worker()
+        self.assertEqual({}, self.sqs.messages)
+        self.assertEqual(2, self.worker_client.send_photo.call_count)
+
+    def test_non_image_payload_replied_and_acknowledged(self):
+        self.processor.handle_image(photo_message('blur 5')).result(1)
+        self.worker_client.download_file.return_value = b'<html>not an image</html>'
+        self.run_worker()
+
+        self.worker_client.send_message.assert_called_once()
+        self.assertTrue(self.worker_client.send_message.call_args[0][1].startswith('Error:'))
+        self.assertEqual({}, self.sqs.messages)
+
+    def test_failing_job_given_up_after_max_receives(self):
+        self.processor.handle_image(photo_message('invert')).result(1)
+        self.worker_client.send_photo.side_effect = ConnectionError('telegram down')
+        handler = FilterJobHandler(self.worker_client, self.ledger)
+        for _ in range(3):
+            list(self.sqs.messages.values())[0]['visible_at'] = 0
+            self.run_worker(handler, max_receives=2, on_give_up=handler.give_up)
+
+        self.assertEqual(2, self.worker_client.send_photo.call_count)
+        self.worker_client.send_message.assert_called_once_with(42, "Error processing image.")
+        self.assertEqual({}, self.sqs.messages)
+
+    def test_concat_of_two_photos_stays_local(self):
+        self.processor.handle_image(photo_message('concat2'))
+        self.assertEqual({}, self.sqs.messages)
+        self.webhook_client.send_message.assert_called_once_with(42, "First image not found.")
+
+
+if __name__ == '__main__':
+    unittest.main()
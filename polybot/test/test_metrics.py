@@ -0,0 +1,92 @@
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+from opentelemetry import metrics as otel_metrics
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import InMemoryMetricReader
+from polybot.img_proc import Img
+from polybot.cache import ResultCache
+from polybot.bot import ImagePredictionBot
+from polybot import metrics
+from polybot.metrics import stage, register_queue
+
+
+def points(reader, name):
+    for resource_metrics in reader.get_metrics_data().resource_metrics:
+        for scope_metrics in resource_metrics.scope_metrics:
+            for metric in scope_metrics.metrics:
+                if metric.name == name:
+                    return {tuple(sorted(p.attributes.items())): p for p in metric.data.data_points}
+    return {}
+
+
+class TestMetrics(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.reader = InMemoryMetricReader()
+        otel_metrics.set_meter_provider(MeterProvider(metric_readers=[cls.reader]))
+
+    def test_filters_recorded_per_step(self):
+        img = Img.from_pixels([[10, 200, 30]] * 8)
+        img.invert()
+        img.flip('horizontal')
+        img.flip('horizontal')
+
+        durations = points(self.reader, 'polybot.stage.duration')
+        flips = durations[(('outcome', 'ok'), ('stage', 'filter'), ('step', 'flip'))]
+        self.assertEqual(2, flips.count)
+        self.assertIn((('outcome', 'ok'), ('stage', 'filter'), ('step', 'invert')), durations)
+
+    def test_failed_stage_marked_as_error(self):
+        with self.assertRaises(ValueError):
+            with stage('download'):
+                raise ValueError('boom')
+        self.assertIn((('outcome', 'error'), ('stage', 'download')), points(self.reader, 'polybot.stage.duration'))
+
+    def test_cache_lookups_by_tier(self):
+        cache = ResultCache()
+        cache.put('a', b'123')
+        cache.get('a')
+        cache.get('b')
+
+        lookups = points(self.reader, 'polybot.cache.requests')
+        self.assertEqual(1, lookups[(('result', 'hit'), ('tier', 'memory'))].value)
+        self.assertEqual(1, lookups[(('result', 'miss'), ('tier', 'memory'))].value)
+
+    def test_queue_depth_observed(self):
+        register_queue('test_queue', lambda: 7)
+        depths = points(self.reader, 'polybot.queue.depth')
+        self.assertEqual(7, depths[(('queue', 'test_queue'),)].value)
+
+    def test_failed_prediction_upload_finishes_job(self):
+        client = MagicMock()
+        client.get_file.return_value = MagicMock(file_path='photos/file_1.jpg')
+        predictor = ImagePredictionBot(client)
+        with patch('polybot.bot.upload_image_bytes_to_s3_in_background', side_effect=ValueError('no bucket')):
+            predictor.handle_image({'chat': {'id': 1}, 'message_id': 1, 'photo': [{'file_id': 'large'}]})
+
+        client.send_message.assert_called_once_with(1, "❌ Prediction failed, try again later.")
+        self.assertEqual(0, points(self.reader, 'polybot.jobs.in_flight')[(('kind', 'prediction'),)].value)
+
+    def test_forked_child_exports_as_its_own_instance(self):
+        provider = metrics._exporting_provider('polybot')
+        self.addCleanup(provider.shutdown)
+        self.assertEqual(os.getpid(), provider._sdk_config.resource.attributes['process.pid'])
+        self.assertTrue(provider._sdk_config.resource.attributes['service.instance.id'].endswith(f'-{os.getpid()}'))
+
+        child_reader = InMemoryMetricReader()
+        register_queue('parent_queue', lambda: 3)
+        with patch.object(metrics, '_exporting_provider', lambda name: MeterProvider(metric_readers=[child_reader])):
+            metrics._after_fork()
+        # back to the instruments of the test's provider
+        self.addCleanup(metrics._create_instruments, otel_metrics.get_meter('polybot'))
+
+        self.assertEqual({}, metrics._queues)
+        with stage('download'):
+            pass
+        self.assertIn((('outcome', 'ok'), ('stage', 'download')), points(child_reader, 'polybot.stage.duration'))
+
+
+if __name__ == '__main__':
+    unittest.main()
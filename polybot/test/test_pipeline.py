@@ -0,0 +1,63 @@
+import unittest
+import random
+from polybot.img_proc import Img
+from polybot.pipeline import Pipeline, InvalidFilterError, parse_caption, optimize
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+CHAIN_FILTERS = ['rotate', 'flip', 'flip horizontal', 'invert', 'segment', 'binary', 'contour', 'blur 3', 'pixel 4', 'concat', 'concat vertical']
+
+
+def apply_one_by_one(img, steps):
+    for step in steps:
+        if step.name == 'concat':
+            img.concat(img, *step.args)
+        else:
+            getattr(img, step.name)(*step.args)
+
+
+class TestPipeline(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pixels = Img(img_path).pixels[:40, :60].round()
+
+    def make_img(self):
+        img = Img(img_path)
+        img.data = self.pixels
+        return img
+
+    def test_parse_caption(self):
+        steps = parse_caption('Blur 5, contour,  flip horizontal, salt and pepper, pixel')
+        self.assertEqual([('blur', (5,)), ('contour', ()), ('flip', ('horizontal',)), ('salt_n_pepper', ()), ('pixelate', (10,))], steps)
+
+    def test_invalid_filter(self):
+        with self.assertRaises(InvalidFilterError):
+            parse_caption('blur, sharpen')
+
+    def test_cancelling_steps(self):
+        self.assertEqual([], optimize(parse_caption('flip, flip, invert, invert, rotate, rotate, rotate, rotate')))
+        self.assertEqual([], optimize(parse_caption('rotate, invert, flip, rotate, invert, flip')))
+
+    def test_point_steps_fused(self):
+        steps = optimize(parse_caption('invert, segment, invert, binary, rotate'))
+        self.assertEqual(['point', 'transform'], [step.name for step in steps])
+
+    def test_matches_one_by_one(self):
+        random.seed(7)
+        for _ in range(200):
+            captions = [random.choice(CHAIN_FILTERS) for _ in range(random.randint(1, 6))]
+            if sum(c.startswith('concat') for c in captions) > 2:
+                continue
+            steps = parse_caption(', '.join(captions))
+
+            expected = self.make_img()
+            apply_one_by_one(expected, steps)
+            actual = Pipeline(steps).run(self.make_img())
+
+            self.assertEqual(expected.data, actual.data, captions)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import json
+import time
+import tempfile
+import threading
+from pathlib import Path
+from polybot.profiling import SlowRequestProfiler, StackSampler, message_tags
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(1000))
+
+
+class TestSlowRequestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.dir.name)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def dumps(self):
+        return [json.loads(p.read_text()) for p in sorted(self.path.glob('*.json'))]
+
+    def test_only_slow_requests_kept(self):
+        profiler = SlowRequestProfiler(0.1, self.path, interval=0.002)
+        with profiler.profile('route', chat_id=1):
+            busy(0.01)
+        with profiler.profile('route', chat_id=2) as tags:
+            tags['dims'] = '640x480'
+            busy(0.15)
+
+        dumps = self.dumps()
+        self.assertEqual(1, len(dumps))
+        self.assertEqual({'chat_id': '2', 'dims': '640x480'}, dumps[0]['tags'])
+        self.assertTrue(any('busy' in stack for stack in dumps[0]['stacks']))
+
+    def test_ring_keeps_newest(self):
+        profiler = SlowRequestProfiler(0, self.path, keep=3)
+        for i in range(5):
+            with profiler.profile('route', chat_id=i):
+                pass
+        self.assertEqual(['2', '3', '4'], [d['tags']['chat_id'] for d in self.dumps()])
+
+    def test_nested_block_covered_by_outer(self):
+        profiler = SlowRequestProfiler(0, self.path)
+        with profiler.profile('route'):
+            with profiler.profile('filter_job'):
+                pass
+        self.assertEqual(['route'], [d['name'] for d in self.dumps()])
+
+    def test_cprofile_mode(self):
+        profiler = SlowRequestProfiler(0, self.path, mode='cprofile')
+        with profiler.profile('handle_message'):
+            busy(0.01)
+        self.assertIn('busy', self.dumps()[0]['stats'])
+
+    def test_unwatched_stacks_not_written(self):
+        sampler = StackSampler(interval=0.001)
+        ident = threading.get_ident()
+        sampler.watch(ident)
+        busy(0.02)
+        stacks = sampler.unwatch(ident)
+        sampled = dict(stacks)
+        busy(0.02)
+        self.assertTrue(sampled)
+        self.assertEqual(sampled, dict(stacks))
+
+    def test_message_tags(self):
+        msg = {'chat': {'id': 5}, 'caption': 'blur 3', 'photo': [{'width': 90, 'height': 60}, {'width': 1280, 'height': 853}]}
+        self.assertEqual({'chat_id': 5, 'caption': 'blur 3', 'dims': '1280x853'}, message_tags(msg))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,232 @@
+import io
+import os
+import threading
+from concurrent.futures import Future
+import unittest
+from unittest.mock import MagicMock, patch
+import boto3
+from boto3.s3.transfer import create_transfer_manager
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+
+os.environ.setdefault('AWS_REGION', 'us-west-2')
+os.environ.setdefault('AWS_S3_BUCKET', 'polybot-test')
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', 'token')
+
+from polybot import s3
+from polybot.s3 import (predicted_images_from_event, wait_for_predicted_image, upload_image_bytes_to_s3_in_background,
+                        read_s3_range, stream_s3_object)
+from polybot.bot import ImagePredictionBot
+
+
+def created(key, event='ObjectCreated:Put'):
+    return {'eventName': event, 's3': {'bucket': {'name': 'polybot-test'}, 'object': {'key': key}}}
+
+
+class StubS3:
+    """
+    head_object and get_object on a dict of keys to bytes.
+    """
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+        self.calls = []
+
+    def head_object(self, Bucket, Key):
+        self.calls.append(('head_object', Key))
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return {'ContentLength': len(self.objects[Key])}
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.calls.append(('get_object', Key))
+        data = self.objects[Key]
+        if Range:
+            start, end = map(int, Range.removeprefix('bytes=').split('-'))
+            data = data[start:end + 1]
+        self.body = StreamingBody(io.BytesIO(data), len(data))
+        return {'Body': self.body}
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestPredictedImagesFromEvent(unittest.TestCase):
+
+    def test_created_predicted_images(self):
+        event = {'Records': [created('42/predicted/image_1.jpg'), created('42/original/image_1.jpg'),
+                             created('43/predicted/image_2.jpg', 'ObjectRemoved:Delete')]}
+        self.assertEqual([('42', '1', '42/predicted/image_1.jpg')], list(predicted_images_from_event(event)))
+
+    def test_keys_are_url_decoded(self):
+        event = {'Records': [created('%2D100123/predicted/image%5F12.jpg')]}
+        self.assertEqual([('-100123', '12', '-100123/predicted/image_12.jpg')], list(predicted_images_from_event(event)))
+
+    def test_records_without_object_skipped(self):
+        event = {'Records': [{'eventName': 'ObjectCreated:Put'}, {}]}
+        self.assertEqual([], list(predicted_images_from_event(event)))
+
+
+class TestWaitForPredictedImage(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.s3 = StubS3()
+        patchers = [patch.object(s3, 's3_client', return_value=self.s3), patch.object(s3, 'time', self.clock)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_found_right_away(self):
+        self.s3.objects['42/predicted/image_1.jpg'] = b'jpeg'
+        self.assertTrue(wait_for_predicted_image('42', '1'))
+        self.assertEqual([], self.clock.sleeps)
+
+    def test_backs_off_until_timeout(self):
+        self.assertFalse(wait_for_predicted_image('42', '1', timeout=20, first_delay=0.5, max_delay=8))
+        self.assertEqual([0.5, 1, 2, 4, 8, 4.5], self.clock.sleeps)
+        self.assertEqual(7, len(self.s3.calls))
+
+    def test_found_after_backoff(self):
+        original_sleep = self.clock.sleep
+
+        def sleep(seconds):
+            original_sleep(seconds)
+            if len(self.clock.sleeps) == 3:
+                self.s3.objects['42/predicted/image_1.jpg'] = b'jpeg'
+        self.clock.sleep = sleep
+        self.assertTrue(wait_for_predicted_image('42', '1'))
+        self.assertEqual([0.5, 1, 2], self.clock.sleeps)
+
+
+class TestPartialDownloads(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = StubS3({'42/predicted/image_1.jpg': bytes(range(256)) * 4})
+        patcher = patch.object(s3, 's3_client', return_value=self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_range_is_inclusive(self):
+        self.assertEqual(bytes(range(10, 20)), read_s3_range('42/predicted/image_1.jpg', 10, 19))
+
+    def test_streamed_in_chunks_and_closed(self):
+        chunks = list(stream_s3_object('42/predicted/image_1.jpg', chunk_size=300))
+        self.assertEqual([300, 300, 300, 124], [len(chunk) for chunk in chunks])
+        self.assertEqual(bytes(range(256)) * 4, b''.join(chunks))
+        self.assertTrue(self.s3.body._raw_stream.closed)
+
+
+class TestBackgroundUpload(unittest.TestCase):
+
+    def setUp(self):
+        client = boto3.session.Session().client('s3', region_name='us-west-2', aws_access_key_id='test',
+                                                aws_secret_access_key='test')
+        self.uploaded = []
+        client.meta.events.register('provide-client-params.s3.PutObject',
+                                    lambda params, **kwargs: self.uploaded.append((params['Bucket'], params['Key'])))
+        self.stubber = Stubber(client)
+        self.stubber.activate()
+        self.addCleanup(self.stubber.deactivate)
+        manager = create_transfer_manager(client, s3.transfer_config())
+        self.addCleanup(manager.shutdown)
+        patcher = patch.object(s3, 'transfer_manager', return_value=manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.done = threading.Event()
+        self.errors = []
+
+    def on_done(self, error):
+        self.errors.append(error)
+        self.done.set()
+
+    def test_uploads_and_reports_success(self):
+        self.stubber.add_response('put_object', {})
+        upload_image_bytes_to_s3_in_background(b'jpeg', '42/original/image_1.jpg', self.on_done).result()
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual([None], self.errors)
+        self.assertEqual([(s3.AWS_S3_BUCKET, '42/original/image_1.jpg')], self.uploaded)
+
+    def test_reports_failure(self):
+        self.stubber.add_client_error('put_object', 'AccessDenied', http_status_code=403)
+        with self.assertRaises(ClientError):
+            upload_image_bytes_to_s3_in_background(b'jpeg', '42/original/image_1.jpg', self.on_done).result()
+        self.assertTrue(self.done.wait(5))
+        self.assertIsInstance(self.errors[0], ClientError)
+
+    def test_prediction_request_not_waited_for(self):
+        self.stubber.add_response('put_object', {})
+        client = MagicMock()
+        client.get_file.return_value = MagicMock(file_path='photos/file_1.jpg')
+        client.download_file.return_value = b'jpeg'
+        predictor = ImagePredictionBot(client)
+        requests = []
+        uploaded = threading.Event()
+
+        def send_prediction_request(chat_id, msg_id):
+            requests.append(Future())
+            return requests[-1]
+        original_on_uploaded = predictor.on_uploaded
+
+        def on_uploaded(*args):
+            original_on_uploaded(*args)
+            uploaded.set()
+        predictor.on_uploaded = on_uploaded
+        with patch('polybot.bot.send_prediction_request', send_prediction_request):
+            predictor.handle_image({'chat': {'id': 42}, 'message_id': 1, 'photo': [{'file_id': 'large'}]})
+            # the upload callback returned while its SQS send is still pending
+            self.assertTrue(uploaded.wait(5))
+        self.assertFalse(requests[0].done())
+
+        requests[0].set_exception(ConnectionError('sqs down'))
+        client.send_message.assert_called_with(42, "❌ Failed to queue image: sqs down")
+
+
+class TestConsumerMessages(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with patch('telebot.TeleBot'):
+            from polybot import consumer
+        cls.consumer = consumer
+
+    def setUp(self):
+        self.bot = MagicMock()
+        self.s3 = StubS3({'42/predicted/image_1.jpg': b'plain', '42/predicted/image_2.jpg': b'shown'})
+        patchers = [patch.object(self.consumer, 'bot', self.bot), patch.object(s3, 's3_client', return_value=self.s3)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_s3_event_sends_only_shown_predictions(self):
+        event = {'Records': [created('42/predicted/image_1.jpg'), created('42/predicted/image_2.jpg')]}
+        with patch('polybot.bot.PREDICTED_IMAGE_CHANNEL', 'event'):
+            self.consumer.handle_message(event)
+        self.bot.send_photo.assert_called_once_with('42', b'shown')
+
+    def test_s3_event_leaves_image_to_callback(self):
+        with patch('polybot.bot.PREDICTED_IMAGE_CHANNEL', 'callback'):
+            self.consumer.handle_message({'Records': [created('42/predicted/image_2.jpg')]})
+        self.bot.send_photo.assert_not_called()
+
+    def test_s3_test_event_acknowledged(self):
+        self.consumer.handle_message({'Service': 'Amazon S3', 'Event': 's3:TestEvent', 'Bucket': 'polybot-test'})
+        self.consumer.handle_message({'chat_id': 42})
+        self.bot.send_photo.assert_not_called()
+        self.bot.send_message.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+import asyncio
+import threading
+from concurrent.futures import Future
+from polybot.scheduler import FairScheduler, ChatRateLimiter, RateLimited, ChatQueueFull, SchedulerFull
+
+
+class TestFairScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.order = []
+        self.done = threading.Event()
+        self.gate = threading.Event()
+
+    def blocked_scheduler(self, **kwargs):
+        """
+        A one worker scheduler whose worker is busy until self.gate is set, so submitted jobs pile up.
+        """
+        scheduler = FairScheduler(1, **kwargs)
+        started = threading.Event()
+        scheduler.submit('gate', 1, lambda: (started.set(), self.gate.wait()))
+        started.wait(1)
+        return scheduler
+
+    def job(self, name, last=False):
+        def run():
+            self.order.append(name)
+            if last:
+                self.done.set()
+        return run
+
+    def test_chats_interleaved(self):
+        scheduler = self.blocked_scheduler(max_queued_per_chat=10)
+        for i in range(3):
+            scheduler.submit('a', 1, self.job('a'))
+        for i in range(3):
+            scheduler.submit('b', 1, self.job('b', last=i == 2))
+        self.gate.set()
+        self.done.wait(1)
+        self.assertEqual(['a', 'b', 'a', 'b', 'a', 'b'], self.order)
+
+    def test_expensive_jobs_get_fewer_turns(self):
+        scheduler = self.blocked_scheduler(max_queued_per_chat=10)
+        for i in range(2):
+            scheduler.submit('heavy', 3, self.job('heavy'))
+        for i in range(6):
+            scheduler.submit('light', 1, self.job('light', last=i == 5))
+        self.gate.set()
+        self.done.wait(1)
+        self.assertEqual(['heavy', 'light', 'light', 'light', 'heavy', 'light', 'light', 'light'], self.order)
+
+    def test_queue_limits(self):
+        scheduler = self.blocked_scheduler(max_queued=3, max_queued_per_chat=2)
+        scheduler.submit('a', 1, self.job('a'))
+        scheduler.submit('a', 1, self.job('a'))
+        with self.assertRaises(ChatQueueFull):
+            scheduler.submit('a', 1, self.job('a'))
+        scheduler.submit('b', 1, self.job('b'))
+        with self.assertRaises(SchedulerFull):
+            scheduler.submit('c', 1, self.job('c'))
+        self.gate.set()
+
+    def test_rate_limited_chat(self):
+        scheduler = FairScheduler(1, ChatRateLimiter(rate=1, burst=2), max_queued_per_chat=10)
+        scheduler.submit('a', 1, self.job('a'))
+        scheduler.submit('a', 1, self.job('a'))
+        with self.assertRaises(RateLimited) as raised:
+            scheduler.submit('a', 1, self.job('a'))
+        self.assertGreater(raised.exception.retry_after, 0.5)
+        scheduler.submit('b', 1, self.job('b'))
+
+    def test_future_holds_the_worker(self):
+        scheduler = FairScheduler(1)
+        pending = Future()
+        scheduler.submit('a', 1, lambda: pending)
+        scheduler.submit('b', 1, self.job('b', last=True))
+        self.assertFalse(self.done.wait(0.2))
+        pending.set_result(None)
+        self.assertTrue(self.done.wait(1))
+
+    def test_run_async(self):
+        scheduler = FairScheduler(1)
+
+        async def job():
+            await asyncio.sleep(0)
+            return 'filtered'
+
+        self.assertEqual('filtered', asyncio.run(scheduler.run_async('a', 1, job)))
+
+    def test_low_priority_after_normal_jobs(self):
+        scheduler = self.blocked_scheduler(max_queued_per_chat=10)
+        scheduler.submit('heavy', 1, self.job('heavy'), low_priority=True)
+        scheduler.submit('a', 5, self.job('a'))
+        scheduler.submit('b', 5, self.job('b'))
+        self.gate.set()
+        scheduler.submit('c', 1, self.job('c', last=True), low_priority=True)
+        self.done.wait(1)
+        self.assertEqual(['a', 'b', 'heavy', 'c'], self.order)
+
+    def test_low_priority_workers_bounded(self):
+        scheduler = FairScheduler(2, low_priority_workers=1)
+        release = threading.Event()
+        scheduler.submit('heavy', 1, lambda: release.wait(), low_priority=True)
+        scheduler.submit('heavy2', 1, self.job('heavy2'), low_priority=True)
+        scheduler.submit('a', 1, self.job('a', last=True))
+        self.done.wait(1)
+        self.assertEqual(['a'], self.order)
+        release.set()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+from polybot.pipeline import parse_caption
+from polybot.sizing import PhotoSizePolicy
+from polybot.cost import AdmissionPolicy
+from polybot.cache import ResultCache
+from polybot.bot import result_cache_key, plan_filter_job
+
+# the sizes Telegram sends of a 2560 x 1920 photo
+PHOTOS = [{'file_id': f'id_{w}', 'file_unique_id': f'u_{w}', 'width': w, 'height': w * 3 // 4}
+          for w in (90, 320, 800, 1280, 2560)]
+
+
+class TestPhotoSizePolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = PhotoSizePolicy(target=1280, bw_target=800, min_block=8, prediction_target=640)
+
+    def select(self, caption, photos=PHOTOS):
+        photo, steps = self.policy.select(photos, parse_caption(caption))
+        return photo['width'], steps
+
+    def test_smallest_size_meeting_target(self):
+        self.assertEqual(1280, self.select('contour')[0])
+
+    def test_levels_scaled_to_chosen_size(self):
+        width, steps = self.select('blur 16, rotate')
+        self.assertEqual(1280, width)
+        self.assertEqual((8,), steps[0].args)
+
+    def test_black_and_white_needs_less(self):
+        self.assertEqual(800, self.select('blur, binary')[0])
+
+    def test_coarse_pixelate_needs_less(self):
+        width, steps = self.select('pixel 64')
+        self.assertEqual(320, width)
+        self.assertEqual((8,), steps[0].args)
+
+    def test_concat_doubles_output(self):
+        self.assertEqual(800, self.select('concat')[0])
+
+    def test_largest_when_none_meets_target(self):
+        self.assertEqual(660, self.select('contour', [{'width': 90, 'height': 67}, {'width': 320, 'height': 240},
+                                                      {'width': 660, 'height': 495}])[0])
+
+    def test_two_photo_concat_keeps_largest(self):
+        self.assertEqual(2560, self.select('concat1')[0])
+
+    def test_unknown_sizes_keep_largest(self):
+        self.assertEqual('b', self.policy.select([{'file_id': 'a'}, {'file_id': 'b'}], parse_caption('blur'))[0]['file_id'])
+
+    def test_prediction_uses_yolo_input_size(self):
+        self.assertEqual(800, self.policy.select_for_prediction(PHOTOS)['width'])
+        self.assertEqual(320, self.policy.select_for_prediction(PHOTOS[:2])['width'])
+
+    def test_cache_keys_of_scaled_plans_differ(self):
+        cache = ResultCache()
+        keys = set()
+        for caption in ('pixel 64', 'pixel 16', 'pixel 8'):
+            photo, steps = self.policy.select(PHOTOS, parse_caption(caption))
+            keys.add(result_cache_key(cache, photo, steps))
+        self.assertEqual(3, len(keys))
+
+    def test_admission_costs_chosen_size(self):
+        msg = {'caption': 'contour', 'photo': PHOTOS}
+        admission = AdmissionPolicy(max_dim=None)
+        self.assertLess(admission.decide_message(msg, self.policy).cost.seconds, admission.decide_message(msg).cost.seconds)
+
+    def test_downscaled_plan_levels_scaled(self):
+        cache = ResultCache()
+        admission = AdmissionPolicy(max_seconds=0.005, low_priority_seconds=1, min_dim=64, max_dim=None)
+        reply, job = plan_filter_job({'caption': 'blur 64', 'photo': PHOTOS}, self.policy, admission, cache)
+
+        self.assertIsNone(reply)
+        self.assertEqual(1280, job.photo['width'])
+        self.assertLess(job.max_dim, 1280)
+        self.assertEqual((round(32 * job.max_dim / 1280),), job.steps[0].args)
+        self.assertEqual(result_cache_key(cache, job.photo, job.steps, job.max_dim), job.cache_key)
+        self.assertIn(f'blur({job.steps[0].args[0]})', job.cache_key)
+
+
+if __name__ == '__main__':
+    unittest.main()
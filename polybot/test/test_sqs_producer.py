@@ -0,0 +1,61 @@
+import unittest
+import json
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from polybot import metrics, sqs_producer
+from polybot.sqs_producer import BatchingProducer, SendError, get_producer
+from polybot.test.fake_sqs import FakeSQS
+
+QUEUE_URL = 'http://localhost/queue/predictions'
+
+
+class RejectingSQS(FakeSQS):
+    """
+    Fails every entry whose body has "reject" set, like SQS does for oversized or invalid entries.
+    """
+
+    def send_message_batch(self, QueueUrl, Entries):
+        accepted = [e for e in Entries if not json.loads(e['MessageBody']).get('reject')]
+        response = super().send_message_batch(QueueUrl, accepted)
+        response['Failed'] = [{'Id': e['Id'], 'Code': 'InvalidMessageContents', 'Message': 'rejected', 'SenderFault': True}
+                              for e in Entries if e not in accepted]
+        return response
+
+
+class TestBatchingProducer(unittest.TestCase):
+
+    def test_burst_sent_in_batches(self):
+        sqs = FakeSQS()
+        producer = BatchingProducer(sqs, QUEUE_URL, linger=0.2)
+
+        with ThreadPoolExecutor(25) as pool:
+            futures = list(pool.map(lambda i: producer.send({'chat_id': i}), range(25)))
+        message_ids = [f.result(timeout=5) for f in futures]
+
+        self.assertEqual(25, len(set(message_ids)))
+        self.assertEqual(3, sqs.calls.count('send_message_batch'))
+        self.assertNotIn('send_message', sqs.calls)
+
+    def test_failed_entries_reported_per_message(self):
+        sqs = RejectingSQS()
+        producer = BatchingProducer(sqs, QUEUE_URL, linger=0.2)
+
+        ok = producer.send({'chat_id': 1})
+        rejected = producer.send({'chat_id': 2, 'reject': True})
+
+        self.assertIn(ok.result(timeout=5), sqs.messages)
+        with self.assertRaises(SendError):
+            rejected.result(timeout=5)
+
+
+    def test_producers_report_their_own_backlog(self):
+        self.addCleanup(sqs_producer._producers.clear)
+        with patch.object(sqs_producer, 'get_client', return_value=FakeSQS()):
+            get_producer(QUEUE_URL)
+            get_producer('http://localhost/queue/filter-jobs', name='filter_jobs')
+        self.assertIn('sqs_producer:predictions', metrics._queues)
+        self.assertIn('sqs_producer:filter_jobs', metrics._queues)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import os
+from unittest.mock import patch
+import numpy as np
+from polybot.img_proc import Img, row_bands
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+def filtered(img, tiles, name, *args, rotate=False):
+    img = Img.from_pixels(img.pixels)
+    with patch('polybot.img_proc.TILE_WORKERS', tiles), patch('polybot.img_proc.TILE_MIN_PIXELS', 0):
+        if rotate:
+            img.rotate()
+        getattr(img, name)(*args)
+    return img.pixels
+
+
+class TestTiledFilters(unittest.TestCase):
+
+    def setUp(self):
+        self.images = [Img(img_path), Img.from_pixels(np.random.default_rng(0).integers(0, 256, (97, 61)))]
+
+    def assertSameAsUntiled(self, name, *args, rotate=False):
+        for img in self.images:
+            for tiles in (2, 3, 7):
+                np.testing.assert_array_equal(filtered(img, 1, name, *args, rotate=rotate),
+                                              filtered(img, tiles, name, *args, rotate=rotate))
+
+    def test_blur(self):
+        for level in (2, 5, 16):
+            self.assertSameAsUntiled('blur', level)
+
+    def test_contour(self):
+        self.assertSameAsUntiled('contour')
+
+    def test_pixelate(self):
+        for level in (3, 10, 40):
+            self.assertSameAsUntiled('pixelate', level)
+
+    def test_rotated_view(self):
+        self.assertSameAsUntiled('blur', 7, rotate=True)
+        self.assertSameAsUntiled('pixelate', 9, rotate=True)
+
+    def test_row_bands(self):
+        self.assertEqual([(0, 4), (4, 8), (8, 10)], row_bands(10, 3))
+        self.assertEqual([(0, 6), (6, 10)], row_bands(10, 3, align=3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import sys
+import asyncio
+import unittest
+import tempfile
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+from aiohttp.test_utils import AioHTTPTestCase
+from polybot.bot import ensure_webhook
+
+URL = 'https://bot.example.com/token/'
+IMAGE = Path(__file__).parent / 'beatles.jpeg'
+TOKEN = '123:token'
+ENV = {'TELEGRAM_BOT_TOKEN': TOKEN, 'BOT_APP_URL': 'https://bot.example.com', 'OTEL_METRICS_EXPORTER': 'none',
+       'FILTER_WORKERS': '1'}
+
+
+def telegram_client(url='', has_custom_certificate=False):
+    client = MagicMock()
+    client.get_webhook_info.return_value = MagicMock(url=url, has_custom_certificate=has_custom_certificate)
+    return client
+
+
+class TestEnsureWebhook(unittest.TestCase):
+
+    def test_unchanged_webhook_left_alone(self):
+        client = telegram_client(URL)
+        self.assertFalse(ensure_webhook(client, URL))
+        client.set_webhook.assert_not_called()
+        client.remove_webhook.assert_not_called()
+
+    def test_different_webhook_replaced(self):
+        client = telegram_client('https://old.example.com/token/')
+        self.assertTrue(ensure_webhook(client, URL))
+        client.set_webhook.assert_called_once_with(url=URL, timeout=60)
+
+    def test_missing_certificate_uploaded(self):
+        client = telegram_client(URL)
+        with tempfile.NamedTemporaryFile() as certificate:
+            self.assertTrue(ensure_webhook(client, URL, certificate.name))
+            self.assertFalse(ensure_webhook(telegram_client(URL, has_custom_certificate=True), URL, certificate.name))
+        self.assertEqual(URL, client.set_webhook.call_args.kwargs['url'])
+
+
+
+class TestFlaskWebhook(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with patch.dict(os.environ, ENV), patch('telebot.TeleBot'):
+            sys.modules.pop('polybot.app', None)
+            import polybot.app
+        cls.app = polybot.app
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.app.filter_pool.shutdown()
+
+    def post(self, update):
+        return self.app.app.test_client().post(f'/{TOKEN}/', json=update)
+
+    def test_failed_update_taken_again_on_retry(self):
+        update = {'update_id': 1, 'message': {'message_id': 1, 'chat': {'id': 5}, 'text': 'hi'}}
+        with patch.object(self.app.bot, 'route', side_effect=[ConnectionError('telegram down'), None]) as route:
+            self.assertEqual(500, self.post(update).status_code)
+            self.assertEqual(200, self.post(update).status_code)
+            self.assertEqual(200, self.post(update).status_code)
+        self.assertEqual(2, route.call_count)
+
+
+
+def photo_update(update_id, caption, message_id=7):
+    return {'update_id': update_id,
+            'message': {'message_id': message_id, 'chat': {'id': 42}, 'caption': caption,
+                        'photo': [{'file_id': 'large', 'file_unique_id': 'u1', 'width': 660, 'height': 495}]}}
+
+
+class TestAsyncWebhook(AioHTTPTestCase):
+
+    async def get_application(self):
+        with patch.dict(os.environ, ENV):
+            sys.modules.pop('polybot.async_app', None)
+            from polybot import async_app
+        app = async_app.create_app()
+        self.telegram = AsyncMock()
+        self.telegram.get_webhook_info.return_value = MagicMock(url='')
+        self.telegram.get_file.return_value = MagicMock(file_path='photos/file_1.jpg')
+        self.telegram.download_file.return_value = IMAGE.read_bytes()
+        app['bot'].telegram_bot_client = self.telegram
+        return app
+
+    async def background_done(self):
+        await asyncio.wait_for(self.app['registration'], 5)
+        while self.app['tasks']:
+            await asyncio.gather(*self.app['tasks'])
+
+    async def test_ready_once_webhook_set(self):
+        await asyncio.wait_for(self.app['registration'], 5)
+        response = await self.client.get('/ready')
+        self.assertEqual(200, response.status)
+        self.telegram.set_webhook.assert_awaited_once_with(url=f'https://bot.example.com/{TOKEN}/', timeout=60)
+
+    async def test_missing_certificate_uploaded(self):
+        await asyncio.wait_for(self.app['registration'], 5)
+        self.telegram.set_webhook.reset_mock()
+        url = f'https://bot.example.com/{TOKEN}/'
+        self.telegram.get_webhook_info.return_value = MagicMock(url=url, has_custom_certificate=False)
+        with tempfile.TemporaryDirectory() as cert_dir:
+            cert = Path(cert_dir) / 'polybot.crt'
+            cert.write_bytes(b'certificate')
+            self.assertTrue(await self.app['bot'].set_webhook('https://bot.example.com', TOKEN, str(cert)))
+        self.telegram.set_webhook.assert_awaited_once_with(url=url, certificate=b'certificate', timeout=60)
+
+    async def test_photo_filtered_once(self):
+        for _ in range(2):
+            response = await self.client.post(f'/{TOKEN}/', json=photo_update(1, 'blur 3'))
+            self.assertEqual(200, response.status)
+        await self.background_done()
+
+        self.telegram.get_file.assert_awaited_once_with('large')
+        self.telegram.send_photo.assert_awaited_once()
+        self.assertEqual(42, self.telegram.send_photo.call_args[0][0])
+
+    async def test_invalid_caption_answered(self):
+        await self.client.post(f'/{TOKEN}/', json=photo_update(2, 'sharpen'))
+        await self.background_done()
+        self.telegram.send_photo.assert_not_awaited()
+        self.telegram.send_message.assert_awaited_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from loguru import logger
+from polybot.img_proc import Img, MAX_DIMENSION
+from polybot.pipeline import Pipeline, plan_key
+from polybot.metrics import register_queue
+from polybot.profiling import profiled
+
+
+def run_pipeline(image_bytes, steps, name='image.jpg', max_dim=None):
+    """
+    Runs a parsed filter plan on an encoded image and returns the encoded filtered image.
+    `max_dim` downscales the image while decoding, when admission control asked for it.
+    This is the unit of work sent to the worker processes, so it only takes picklable arguments.
+    """
+    with profiled('filter_job', plan=plan_key(steps) or ','.join(step.name for step in steps)) as tags:
+        img = Img.from_bytes(image_bytes, name, max_dim or MAX_DIMENSION)
+        tags['dims'] = '{1}x{0}'.format(*img.pixels.shape)
+        Pipeline(steps).run(img)
+        return img.to_bytes()
+
+
+def run_inline(fn, *args):
+    """
+    Runs `fn` in the calling thread and wraps the outcome in a Future, like FilterPool.submit does.
+    """
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+class FilterPool:
+    """
+    A bounded pool of worker processes for the CPU heavy filter jobs.
+    At most `max_pending` jobs are queued or running at once, `submit` returns None when the pool is full
+    so the caller can push back instead of piling up work.
+    """
+
+    def __init__(self, max_workers=None, max_pending=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.max_workers
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        # fork the workers now, before the web server starts its threads
+        self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('fork'))
+        self._executor.submit(int).result()
+        logger.info(f'Filter pool started with {self.max_workers} workers, up to {self.max_pending} pending jobs')
+        register_queue('filter_pool', lambda: self.queued)
+
+    @property
+    def pending(self):
+        """
+        Jobs queued or running right now.
+        """
+        return self._pending
+
+    @property
+    def queued(self):
+        """
+        Jobs waiting for a free worker process.
+        """
+        return max(0, self._pending - self.max_workers)
+
+    def _job_done(self, _):
+        with self._pending_lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            return None
+        with self._pending_lock:
+            self._pending += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._job_done(None)
+            raise
+        future.add_done_callback(self._job_done)
+        return future
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)